@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the pass prediction engines of satbazaar.db.
+
+The TLEs and stations in benchmark/ are fixed, so results compare between
+runs and machines.  For every engine this reports the wall time, propagator
+calls (for the engines which count them), passes per second and peak
+memory.  The passes are then matched with those of a high resolution
+reference to count the missed and extra passes and to find the largest and
+mean differences of rise, set, TCA and max elevation.
+"""
+
+import argparse
+from contextlib import redirect_stdout
+from datetime import timedelta
+from functools import partial
+import json
+import os
+import time
+import tracemalloc
+
+import ephem
+
+from satbazaar import db
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The amateur satellites are in low orbits.  high-orbits.txt has made up
+# elements of a GPS-like MEO and a Molniya-like HEO, whose passes last hours.
+TLE_FILES = (os.path.join(HERE, 'benchmark', 'amateur.txt'),
+             os.path.join(HERE, 'benchmark', 'high-orbits.txt'))
+STATIONS_FILE = os.path.join(HERE, 'benchmark', 'stations.json')
+
+# the fixture TLEs are from early June 2017
+START_TIME = '2017/6/8 00:00:00'
+
+ENGINES = {
+    'sgp4': db.compute_passes_sgp4,
+    'peaks': db.compute_passes_peaks,
+    'ephem': db.compute_passes_ephem,
+    'orbital': db.compute_passes_orbital,
+}
+
+# engines which accept a list of stations for by_satellite jobs
+VECTORIZED = ('sgp4', 'peaks')
+
+# many more samples per orbit and finer roots than any engine uses
+REFERENCE = partial(db.compute_passes_sgp4, steps_per_orbit=2000, tol=1e-4)
+
+# Passes rising this close to the ends of the window are not compared, the
+# engines differ in how they treat passes at the ends.
+EDGE = timedelta(minutes=1)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('engines', nargs='*', default=['sgp4', 'peaks', 'ephem'],
+                    choices=sorted(ENGINES), metavar='engine',
+                    help='Engines to run, of %s (default: %%(default)s)'
+                    % ', '.join(sorted(ENGINES)))
+parser.add_argument('--start', default=START_TIME,
+                    help='Start of the window (default: %(default)s)')
+parser.add_argument('--hours', type=float, default=72,
+                    help='Length of the window (default: %(default)s)')
+parser.add_argument('--stations', type=int,
+                    help='Use only the first N stations')
+parser.add_argument('--satellites', type=int,
+                    help='Use only the first N satellites')
+parser.add_argument('--by-satellite', action='store_true', default=False,
+                    help='One job per satellite for the vectorized engines')
+parser.add_argument('--no-memory', dest='memory', action='store_false',
+                    default=True,
+                    help='Skip the second run which measures peak memory')
+parser.add_argument('--json', action='store_true', default=False,
+                    help='Print a JSON object per engine instead of a table')
+
+
+def load_satellites(filename):
+    """Returns a list of satellite dicts from a file of 3-line TLEs."""
+    with open(filename) as f:
+        lines = [line.rstrip() for line in f if line.strip()]
+    return [{'norad_cat_id': int(lines[i + 1][2:7]),
+             'name': lines[i].strip(),
+             'tle': lines[i:i + 3]}
+            for i in range(0, len(lines), 3)]
+
+
+def make_jobs(stations, satellites, start, hours, by_satellite):
+    if by_satellite:
+        return [(stations, sat, start, None, hours) for sat in satellites]
+    return [(gs, sat, start, None, hours)
+            for gs in stations for sat in satellites]
+
+
+def run(compute_function, jobs):
+    """Returns the passes of all jobs, the wall time and propagator calls."""
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        t = time.perf_counter()
+        results = [compute_function(args) for args in jobs]
+        wall = time.perf_counter() - t
+
+    calls = [getattr(r, 'calls', None) for r in results]
+    calls = None if None in calls else sum(calls)
+    passes = [p for r in results for p in r]
+    return passes, wall, calls
+
+
+def peak_memory(compute_function, jobs):
+    """Returns the peak of memory allocated while running all jobs."""
+    tracemalloc.start()
+    try:
+        run(compute_function, jobs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def compare(reference, passes, start, end):
+    """Match passes to the reference passes they overlap in time.
+
+    Returns the number of missed and extra passes, and for the matched ones
+    a dict of field -> (max, mean) absolute difference, in seconds for the
+    times and degrees for max_el.
+    """
+    def by_pair(passes):
+        pairs = {}
+        for p in passes:
+            if start + EDGE <= p.start <= end - EDGE:
+                pairs.setdefault((p.gs, p.norad), []).append(p)
+        for v in pairs.values():
+            v.sort()
+        return pairs
+
+    ref, new = by_pair(reference), by_pair(passes)
+    missed = extra = 0
+    matched = []
+    for key in ref.keys() | new.keys():
+        a, b = ref.get(key, []), new.get(key, [])
+        i = j = 0
+        while i < len(a) and j < len(b):
+            if a[i].end < b[j].start:
+                missed += 1
+                i += 1
+            elif b[j].end < a[i].start:
+                extra += 1
+                j += 1
+            else:
+                matched.append((a[i], b[j]))
+                i += 1
+                j += 1
+        missed += len(a) - i
+        extra += len(b) - j
+
+    diffs = {}
+    for field in ('start', 'end', 'tca', 'max_el'):
+        d = [abs(getattr(p, field) - getattr(q, field)) for p, q in matched]
+        d = [x.total_seconds() if isinstance(x, timedelta) else x for x in d]
+        diffs[field] = (max(d), sum(d) / len(d)) if d else (None, None)
+    return missed, extra, diffs
+
+
+def fmt(x, spec):
+    return '-' if x is None else format(x, spec)
+
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+
+    stations = list(db.load_stations(STATIONS_FILE).values())[:opts.stations]
+    satellites = [sat for filename in TLE_FILES
+                  for sat in load_satellites(filename)][:opts.satellites]
+    start = ephem.date(opts.start).datetime()
+    end = start + timedelta(hours=opts.hours)
+    print('%i stations, %i satellites, %g hours from %s'
+          % (len(stations), len(satellites), opts.hours, start))
+
+    reference, wall, _ = run(REFERENCE, make_jobs(stations, satellites,
+                                                  opts.start, opts.hours,
+                                                  True))
+    print('reference: %i passes in %.1f s' % (len(reference), wall))
+
+    header = ('%-8s %6s %7s %9s %9s %10s %8s %6s %6s'
+              ' %14s %14s %14s %14s')
+    print(header % ('engine', 'jobs', 'passes', 'wall s', 'passes/s',
+                    'calls', 'peak MB', 'missed', 'extra', 'rise s',
+                    'set s', 'tca s', 'max_el deg'))
+
+    for name in opts.engines:
+        by_satellite = opts.by_satellite and name in VECTORIZED
+        jobs = make_jobs(stations, satellites, opts.start, opts.hours,
+                         by_satellite)
+        try:
+            passes, wall, calls = run(ENGINES[name], jobs)
+        except ImportError as e:
+            print('%-8s skipped, %s' % (name, e))
+            continue
+        memory = peak_memory(ENGINES[name], jobs) if opts.memory else None
+        missed, extra, diffs = compare(reference, passes, start, end)
+
+        if opts.json:
+            print(json.dumps({
+                'engine': name,
+                'jobs': len(jobs),
+                'passes': len(passes),
+                'wall': wall,
+                'passes_per_second': len(passes) / wall,
+                'calls': calls,
+                'peak_memory': memory,
+                'missed': missed,
+                'extra': extra,
+                'diffs': diffs,
+            }))
+            continue
+
+        row = [name, len(jobs), len(passes), '%.2f' % wall,
+               '%.0f' % (len(passes) / wall), fmt(calls, 'd'),
+               fmt(memory and memory / 2**20, '.1f'), missed, extra]
+        for field in ('start', 'end', 'tca', 'max_el'):
+            worst, mean = diffs[field]
+            row.append('%s / %s' % (fmt(worst, '.3f'), fmt(mean, '.3f')))
+        print(header % tuple(row))
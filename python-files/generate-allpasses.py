@@ -5,8 +5,6 @@ import pickle
 import sys
 import time
 
-import cProfile
-
 from satbazaar import db
 
 
@@ -21,9 +19,43 @@ satsfile = 'satellites.json'
 # dbfile = 'allpasses.sqlite'
 dbfile = 'passes_2018-08-16.sqlite'
 
-compute_function = db.compute_passes_ephem
+compute_function = db.compute_passes_sgp4
+# compute_function = db.compute_passes_peaks
+# compute_function = db.compute_passes_ephem
 # compute_function = db.compute_passes_orbital
 
+# propagate each satellite once for all stations, needs compute_passes_sgp4
+# or compute_passes_peaks
+by_satellite = True
+
+# propagate each satellite with all its TLEs from the tle_db which are valid
+# during the window, switching between them, instead of only the latest one.
+# Needs compute_passes_sgp4 or compute_passes_peaks
+tle_history = False
+
+# update an existing dbfile, recomputing only the station--satellite pairs
+# whose TLE or station changed and extending the others to the new window
+incremental = False
+
+# split long windows into shards of this many hours to spread them over the
+# processes, None to compute each job's window in one go
+shard_hours = None
+
+# reuse the passes of pairs with unchanged TLE, station and window from
+# earlier runs, e.g. db.config['DEFAULT']['passes_cache'], None to not cache
+cache_db = None
+
+# per job wall time, passes and failure codes as JSON lines to this file, or
+# True for the job_metrics table in dbfile
+metrics = None
+
+# save the profile of all jobs, added up over the processes, to this file
+profile = None
+
+# also export the passes to this .npy file as a db.PassStore, which loads
+# memory-mapped for simulations, None to not export
+pass_store = None
+
 start_time = '2018/8/16 00:00:00'
 # duration = 8760 #a year worth of hours
 # duration = 24*90
@@ -54,6 +86,8 @@ print(len(stations), 'filtered stations')
 # satellites
 #
 sats = db.load_satellites(satsfile)
+if tle_history:
+    db.load_tle_history(sats.values(), start_time, duration)
 
 
 #
@@ -73,8 +107,6 @@ print(len(sats), 'satellites')
 line = '-- %-30s -------------'
 print(line % 'Computing passes')
 
-#pr = cProfile.Profile()
-#pr.enable()
 tree = db.compute_all_passes(
                           iter(stations.values()),
                           iter(sats.values()),
@@ -82,12 +114,20 @@ tree = db.compute_all_passes(
                           duration=duration,
                           passes_db=dbfile,
                           num_processes=num_processes,
-                          compute_function=compute_function)
-#pr.disable()
-#pr.print_stats(sort='time')
+                          compute_function=compute_function,
+                          by_satellite=by_satellite,
+                          incremental=incremental,
+                          shard_hours=shard_hours,
+                          cache_db=cache_db,
+                          metrics=metrics,
+                          profile=profile)
 # give the filesystem some time to finish closing the database file
 time.sleep(1)
 
+if pass_store:
+    print(line % 'Exporting pass store')
+    db.PassStore.from_db(dbfile).save(pass_store)
+
 #testing save/load between pickle and sqlite3
 nfail = 0
 if False:
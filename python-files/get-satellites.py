@@ -19,7 +19,7 @@ from lxml import html
 import requests
 import requests_cache
 
-from satbazaar.db import TLESource
+from satbazaar.db import TLEMissCache, TLESource, create_tle_table
 
 requests_cache.install_cache('.get-satellites-cache.db', expire_after=60*60)
 
@@ -32,7 +32,9 @@ SATELLITES_JSON = 'satellites.json'
 TLE_DB = 'tle.sqlite'
 
 
-tle_source = TLESource()
+# remember which sources did not have a satellite, in the TLE database
+misses = TLEMissCache(TLE_DB)
+tle_source = TLESource(misses=misses)
 
 
 # fetch satellites known to the network
@@ -48,31 +50,25 @@ with open(SATELLITES_JSON, 'w') as fp:
 conn = sqlite3.connect('file:' + TLE_DB, uri=True,
                        detect_types=sqlite3.PARSE_DECLTYPES)
 cur = conn.cursor()
-cur.execute('''CREATE TABLE IF NOT EXISTS tle
-            (norad integer,
-             epoch timestamp,
-             line0 text,
-             line1 text,
-             line2 text,
-             downloaded timestamp,
-             unique(norad, epoch)
-            );''')
-
-UPDATED = 0
+create_tle_table(cur)
+
+# fetch all TLEs at once, from the group files where possible
+# don't bother getting TLE for a re-entered satellite
+tles = tle_source.get_many([norad for norad, sat in satellites.items()
+                            if sat['status'] != 're-entered'])
+
+rows = []
+downloaded = datetime.utcnow()
 for norad, sat in satellites.items():
-    # don't bother getting TLE for a re-entered satellite
     if sat['status'] == 're-entered':
         if DO_PRINT:
             print(norad, 'has re-entered')
         continue
 
-    # TLESource lazily fetches TLEs only when requested.
-    # using catching the KeyError is faster than (norad in tle_source)
-    #
     # vvv ensure we don't use a tle from the previous loop
     tle = None
     try:
-        tle = tle_source[norad]
+        tle = tles[norad]
     except KeyError:
         if DO_PRINT:
             print('{} no TLE'.format(norad))
@@ -81,26 +77,20 @@ for norad, sat in satellites.items():
         if DO_PRINT:
             print('{} from {}'.format(norad, tle.source))
 
-    try:
-        cur.execute(
-          'INSERT INTO tle VALUES (?,?,?,?,?,?);',
-          (norad,
-           tle.epoch,
-           tle.line0,
-           tle.line1,
-           tle.line2,
-           datetime.utcnow()))
-        # 'INSERT OR IGNORE INTO ...' will suppress the exception
-    except sqlite3.IntegrityError:
-        pass
-    else:
-        conn.commit()
-        UPDATED += 1
-    finally:
-        pass
-
-conn.commit()
+    rows.append((norad,
+                 tle.epoch,
+                 tle.line0,
+                 tle.line1,
+                 tle.line2,
+                 downloaded))
+
+# all new TLEs in one transaction, known ones are ignored
+with conn:
+    before = conn.total_changes
+    cur.executemany('INSERT OR IGNORE INTO tle VALUES (?,?,?,?,?,?);', rows)
+    UPDATED = conn.total_changes - before
 conn.close()
+misses.close()
 
 if UPDATED:
     print(UPDATED, 'updates')
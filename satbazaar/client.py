@@ -5,6 +5,10 @@ from datetime import timedelta
 
 from intervaltree import Interval, IntervalTree
 from iso8601 import parse_date
+import numpy as np
+
+from satbazaar import predict
+
 
 
 
@@ -129,6 +133,93 @@ class BaseClient:
             start = dayend
         return busy_time_days
 
+    def rematch(self, tle):
+        """Re-map the scheduled jobs of this client onto a new TLE.
+
+        See rematch(), returns the lists of updated and cancelled requests.
+        """
+        return rematch([self], tle)
+
+
+def rematch(clients, tle):
+    """Re-map the scheduled jobs of clients onto a new TLE of their satellite.
+
+    tle: 3 element list containing [line0, line1, line2]
+
+    Every job in the client calendars for the satellite of `tle` which was
+    scheduled with a different TLE is matched by its time of closest
+    approach, see predict.match_tca().  The new TLE is only propagated in a
+    window of an orbit around each job, so the cost is proportional to the
+    number of scheduled jobs.
+
+    Matched jobs get the new TLE and their 'start', 'end' and 'tca' updated
+    in place, as ISO 8601 times with their microseconds, and move in the
+    calendar.  Jobs whose matched TCA is below the station's horizon, its
+    'min_horizon' if it has one and 0 otherwise, are cancelled and removed
+    from the calendar.
+
+    Returns the lists of updated and cancelled requests.
+    """
+    tle = tuple(tle)
+    norad = int(tle[1][2:7])
+
+    # all jobs to re-map, with the index of their client
+    found = []
+    for c, client in enumerate(clients):
+        for iv in client.calendar:
+            job = iv.data['job']
+            if (int(job['tle1'][2:7]) == norad
+                    and (job['tle1'], job['tle2']) != tle[1:]):
+                found.append((c, iv))
+    if not found:
+        return [], []
+
+    start = min(iv.begin for _, iv in found)
+    pos, rot = predict.station_frames([client.lat for client in clients],
+                                      [client.lon for client in clients],
+                                      [client.alt for client in clients])
+    horizon = [getattr(client, 'data', {}).get('min_horizon', 0)
+               for client in clients]
+
+    which = np.array([c for c, _ in found])
+    aos = np.array([(iv.begin - start).total_seconds() for _, iv in found])
+    los = np.array([(iv.end - start).total_seconds() for _, iv in found])
+
+    # the old TCAs come from the TLE each job was scheduled with
+    prop1 = predict.Propagator(tle, start)
+    by_tle = defaultdict(list)
+    for k, (_, iv) in enumerate(found):
+        job = iv.data['job']
+        by_tle[job['tle0'], job['tle1'], job['tle2']].append(k)
+    matched = {}
+    for old, idx in by_tle.items():
+        prop0 = predict.Propagator(old, start)
+        m = predict.match_tca(prop0, prop1, pos, rot, horizon,
+                              which[idx], aos[idx], los[idx])
+        for key, values in m.items():
+            matched.setdefault(key, np.empty(len(found)))[idx] = values
+
+    updated, cancelled = [], []
+    for k, (c, iv) in enumerate(found):
+        calendar = clients[c].calendar
+        calendar.remove(iv)
+        r = iv.data
+        if matched['max_el'][k] < horizon[c]:
+            cancelled.append(r)
+            continue
+
+        job = r['job']
+        job['tle0'], job['tle1'], job['tle2'] = tle
+        for field, key in (('start', 'rise'), ('end', 'set'), ('tca', 'tca')):
+            # a satellite which does not set keeps the old start and end
+            if np.isfinite(matched[key][k]):
+                t = start + timedelta(seconds=float(matched[key][k]))
+                job[field] = t.isoformat()
+        calendar.add(Interval(parse_date(job['start']),
+                              parse_date(job['end']), r))
+        updated.append(r)
+    return updated, cancelled
+
 
 class AllClient(BaseClient):
     """Represents a SatNOGS client which implements the SatNOGS-Broker
@@ -8,26 +8,41 @@ from a database.
 
 Ground Station information is stored in a JSON file.
 """
+import cProfile
 import os
 from collections import namedtuple, OrderedDict
-from collections.abc import Mapping
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime, timedelta, timezone
-from itertools import product, islice
+from fnmatch import fnmatchcase
+from functools import partial
+import hashlib
+from itertools import islice
 import json
 import multiprocessing
 from math import pi
-from io import StringIO
+from io import IOBase
+import pickle
+import pstats
+import queue
 import sqlite3
+import threading
+import time
 import configparser
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
 
 
 from lxml import html
 
 import ephem
 from intervaltree import Interval, IntervalTree
+import numpy as np
 import requests
 import requests_cache
+from sgp4.api import Satrec, SatrecArray
 
+from satbazaar import predict
 from satbazaar import util
 
 requests_cache.install_cache('.satbazaar-db-cache', expire_after=60*60)
@@ -53,12 +68,95 @@ config.read([
 PassTuple = namedtuple('PassTuple',
                        'start end duration rise_az set_az tca max_el gs norad')
 
+
+class PassList(list):
+    """List of PassTuple as returned by the compute_passes_*() functions.
+
+    `calls` is the number of times the orbit was propagated to find the
+    passes, None if the engine does not tell.  `codes` has a letter for each
+    problem met, as in the progress lines: 'E' the search failed, 'F' no
+    rise, transit or set found, 'N' a set before the rise.
+    """
+    calls = None
+    codes = ''
+
+
 # order used in TLE database
 TleTuple = namedtuple('TleTuple',
                       'norad epoch line0 line1 line2 downloaded')
 
 STATION_KEYS = ('alt', 'lat', 'lon', 'min_horizon', 'name', 'status')
 
+# pages of a network's stations fetched at once
+STATION_WORKERS = 8
+
+# compute_all_passes() writes passes to the database in batches of this many
+BATCH_SIZE = 10000
+
+# upper limit on the number of jobs sent to a pool worker at once
+MAX_CHUNKSIZE = 64
+
+# compute_all_passes() starts the largest jobs first within batches of this
+# many, in the order they are planned
+COST_BATCH = 10000
+
+# Neighboring time shards overlap by this much, passes rising this close to
+# a shard boundary are found by both shards and kept once.
+SHARD_OVERLAP = timedelta(minutes=1)
+
+# The pass cache holds the passes of windows extended to multiples of this,
+# counted from CACHE_EPOCH, so runs with nearby start times share entries.
+CACHE_BUCKET = timedelta(hours=1)
+CACHE_EPOCH = datetime(2000, 1, 1)
+
+# default limit on the bytes of pickled passes kept in the pass cache
+CACHE_SIZE = 2**30
+
+# getpasses() keeps the results of this many queries
+PASSES_CACHE_SIZE = 32
+
+# compute_all_passes() prints throughput and ETA this often, seconds
+PROGRESS_INTERVAL = 60
+
+# number of functions printed from the profile of compute_all_passes()
+PROFILE_LINES = 25
+
+# concurrent requests and requests per second to each TLE API
+API_WORKERS = 8
+API_RATE = 10.0
+
+# "not found in this source" is remembered this long by TLEMissCache
+TLE_MISS_TTL = timedelta(days=1)
+
+# version of the tle database layout, see _migrate_tle_epochs()
+TLE_DB_VERSION = 1
+
+# columns of TLECatalog.data
+TLE_DTYPE = np.dtype([
+    ('norad', 'i4'),
+    ('epoch', 'datetime64[us]'),
+    ('inclination', 'f8'),
+    ('raan', 'f8'),
+    ('eccentricity', 'f8'),
+    ('ap', 'f8'),
+    ('mean_anomaly', 'f8'),
+    ('mean_motion', 'f8'),
+])
+
+
+# columns of PassStore.data, times as naive UTC, gs is an index into
+# PassStore.stations
+PASS_DTYPE = np.dtype([
+    ('start', 'datetime64[us]'),
+    ('end', 'datetime64[us]'),
+    ('duration', 'f8'),
+    ('rise_az', 'f8'),
+    ('set_az', 'f8'),
+    ('tca', 'datetime64[us]'),
+    ('max_el', 'f8'),
+    ('gs', 'i4'),
+    ('norad', 'i4'),
+])
 
 
 class TLE:
@@ -79,7 +177,8 @@ class TLE:
 
         y = self._year_digits(tle[1][18:20])
         year = datetime(y, 1, 1, tzinfo=timezone.utc)
-        jd = timedelta(days=float(tle[1][20:32]))
+        # day of the year starts at 1.0 for January 1, 00:00
+        jd = timedelta(days=float(tle[1][20:32]) - 1)
         self.epoch = year + jd
 
         self.elset = int(tle[1][64:68])
@@ -119,6 +218,231 @@ class TLE:
         )
 
 
+def iter_3le(lines):
+    """Yields (line0, line1, line2) tuples from an iterable of text lines
+    with 3 lines per TLE.  Blank lines are skipped.
+    """
+    group = []
+    for line in lines:
+        line = line.rstrip()
+        if not line:
+            continue
+        group.append(line)
+        if len(group) == 3:
+            yield tuple(group)
+            group = []
+
+
+class TLECatalog(Mapping):
+    """Columnar catalog of many TLEs, parsed in bulk.
+
+    The mean elements are in `data`, a NumPy structured array of TLE_DTYPE
+    with one row per TLE in the order given, epochs as naive UTC.  The raw
+    lines are kept as bytes in `lines`, shape (rows, 3), and only turned
+    into TLE objects when asked for.
+
+    As a mapping, the catalog returns the TLE with the newest epoch of each
+    NORAD number.
+    """
+    def __init__(self, lines=(), source=None):
+        """
+        lines: iterable of text lines, 3 per TLE, blank lines are skipped
+        source: short string to identify the source of the TLEs
+        """
+        self.source = source
+        raw = [line.encode() for group in iter_3le(lines) for line in group]
+        self.lines = np.array(raw, dtype=bytes).reshape(len(raw) // 3, 3)
+        self.data = self._parse(self.lines)
+        self._index()
+
+    def _index(self):
+        """Finds the newest row of each NORAD number, by sorted NORAD
+        number.
+        """
+        order = np.lexsort((self.data['epoch'], self.data['norad']))
+        norads = self.data['norad'][order]
+        last = np.ones(len(norads), dtype=bool)
+        last[:-1] = norads[1:] != norads[:-1]
+        self._norads = norads[last]
+        self._rows = order[last]
+
+    def update(self, groups):
+        """Applies new and changed TLEs from (line0, line1, line2) groups.
+
+        The newest row of a NORAD number is replaced when its lines changed,
+        new ones are added.  Only those rows are parsed.  Returns the set of
+        NORAD numbers added or changed.
+        """
+        latest = {}
+        for group in groups:
+            latest[int(group[1][2:7])] = [line.encode() for line in group]
+        if not latest:
+            return set()
+
+        norads = np.array(list(latest))
+        rows = self.rows(norads)
+        lines = np.array(list(latest.values()), dtype=bytes)
+        keep = rows < 0
+        old = np.nonzero(~keep)[0]
+        keep[old] = ~(self.lines[rows[old]] == lines[old]).all(axis=1)
+        norads, rows, lines = norads[keep], rows[keep], lines[keep]
+        if len(norads) == 0:
+            return set()
+
+        data = self._parse(lines)
+        width = max(self.lines.dtype.itemsize, lines.dtype.itemsize)
+        self.lines = self.lines.astype('S%i' % width)
+        old = rows >= 0
+        self.lines[rows[old]] = lines[old]
+        self.data[rows[old]] = data[old]
+        self.lines = np.concatenate((self.lines, lines[~old]))
+        self.data = np.concatenate((self.data, data[~old]))
+        self._index()
+        return set(norads.tolist())
+
+    @classmethod
+    def from_text(cls, text, source=None):
+        """Returns the catalog of a string of 3-line TLEs."""
+        return cls(text.splitlines(), source)
+
+    @staticmethod
+    def _parse(lines):
+        n = len(lines)
+        line1 = np.frombuffer(lines[:, 1].astype('S69').tobytes(),
+                              dtype='S1').reshape(n, 69)
+        line2 = np.frombuffer(lines[:, 2].astype('S69').tobytes(),
+                              dtype='S1').reshape(n, 69)
+
+        def field(line, a, b, dtype=float):
+            return np.ascontiguousarray(line[:, a:b]).view(
+                'S%i' % (b - a)).ravel().astype(dtype)
+
+        data = np.empty(n, dtype=TLE_DTYPE)
+        data['norad'] = field(line1, 2, 7, int)
+        norad2 = field(line2, 2, 7, int)
+        bad = np.nonzero(data['norad'] != norad2)[0]
+        if len(bad):
+            raise TypeError(
+                'Inconsistent catalog numbers: {} - {}'.format(
+                    data['norad'][bad[0]], norad2[bad[0]]))
+
+        # two-digit years as in TLE._year_digits(), day of the year starts
+        # at 1.0 for January 1, 00:00
+        y = field(line1, 18, 20, int)
+        year = np.where(y < 57, y + 2000, y + 1900)
+        day = field(line1, 20, 32) - 1.0
+        data['epoch'] = ((year - 1970).astype('datetime64[Y]')
+                         + np.round(day * 86400e6).astype('timedelta64[us]'))
+
+        data['inclination'] = field(line2, 8, 16)
+        data['raan'] = field(line2, 17, 25)
+        data['eccentricity'] = field(line2, 26, 33) * 1e-7
+        data['ap'] = field(line2, 34, 42)
+        data['mean_anomaly'] = field(line2, 43, 51)
+        data['mean_motion'] = field(line2, 52, 63)
+        return data
+
+    def rows(self, norads):
+        """Returns the row of the newest TLE for each of norads, -1 for the
+        ones not in the catalog.
+        """
+        norads = np.asarray(norads)
+        if len(self._norads) == 0:
+            return np.full(norads.shape, -1)
+        i = np.searchsorted(self._norads, norads)
+        i = np.minimum(i, len(self._norads) - 1)
+        return np.where(self._norads[i] == norads, self._rows[i], -1)
+
+    def tle_lines(self, row):
+        """Returns the (line0, line1, line2) strings of a row."""
+        return tuple(line.decode() for line in self.lines[row])
+
+    def tle(self, row):
+        """Returns the TLE object of a row."""
+        return TLE(self.tle_lines(row), source=self.source)
+
+    def satrecs(self, rows=None):
+        """Returns an sgp4 SatrecArray to propagate the TLEs of rows, all
+        rows by default, at once.
+        """
+        if rows is None:
+            rows = range(len(self.lines))
+        return SatrecArray([Satrec.twoline2rv(*self.tle_lines(row)[1:])
+                            for row in rows])
+
+    def __getitem__(self, norad):
+        row = self.rows([norad])[0]
+        if row < 0:
+            raise KeyError('{} not found'.format(norad))
+        return self.tle(row)
+
+    def __iter__(self):
+        return iter(self._norads.tolist())
+
+    def __len__(self):
+        return len(self._norads)
+
+
+class TLEMissCache:
+    """Persistent record of the satellites a TLE source did not have.
+
+    TLESource skips asking a source again for a satellite it missed less
+    than `ttl` ago.  The misses are kept in the tle_misses table of
+    `filename`, which may be the TLE database itself.
+    """
+    def __init__(self, filename, ttl=TLE_MISS_TTL):
+        self.ttl = ttl
+        self.conn = sqlite3.connect('file:' + filename, uri=True)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS tle_misses
+                  (source text,
+                  norad integer,
+                  checked real,
+                  PRIMARY KEY (source, norad));''')
+        self.conn.commit()
+        self._missing = {}
+
+    def missing(self, source):
+        """Returns the set of NORAD numbers recently missed by source."""
+        if source not in self._missing:
+            since = time.time() - self.ttl.total_seconds()
+            rows = self.conn.execute('''SELECT norad FROM tle_misses
+                                       WHERE source = ? AND checked > ?;''',
+                                     (source, since))
+            self._missing[source] = {norad for norad, in rows}
+        return self._missing[source]
+
+    def add(self, source, norads):
+        """Records that source does not have norads."""
+        norads = list(norads)
+        self.missing(source).update(norads)
+        now = time.time()
+        self.conn.executemany('''INSERT OR REPLACE INTO tle_misses
+                                 VALUES (?,?,?);''',
+                              [(source, norad, now) for norad in norads])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class _RateLimiter:
+    """Spaces the calls to wait() at least 1/rate seconds apart, across
+    threads.  A rate of None does not limit.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            t = max(now, self.next)
+            self.next = t + self.interval
+        if t > now:
+            time.sleep(t - now)
+
+
 class TLESource(Mapping):
     r"""Dictionary-like mapping which returns a TLE object for a given NORAD number.
     Configured sources are tried in order or raises a KeyError if the number is
@@ -133,23 +457,62 @@ class TLESource(Mapping):
     >>> repr(d[25544])  #doctest: +ELLIPSIS
     "TLE(source=CelesTrak, line0='ISS (ZARYA)', line1='1 25544U 98067A ..."
     """
-    def __init__(self, sources=None, fn=None):
+    def __init__(self, sources=None, fn=None, misses=None):
+        """
+        sources: (name, class, *args) tuples, default TLE_SOURCES
+        misses: TLEMissCache of the satellites to not ask sources for
+        """
         self._data = {}
         if sources is None:
             sources = TLE_SOURCES
+        self.misses = misses
 
         self.data_source = {}
-        for name, method, arg in sources:
-            self.data_source[name] = method(name, arg)
+        for name, method, *args in sources:
+            self.data_source[name] = method(name, *args)
 
     def __getitem__(self, norad):
         for source, d in self.data_source.items():
-            if norad in d:
+            if (self.misses is not None
+                    and norad in self.misses.missing(source)):
+                continue
+            try:
                 v = d[norad]
-                self._data[norad] = v
-                return v
+            except KeyError:
+                if self.misses is not None:
+                    self.misses.add(source, [norad])
+                continue
+            self._data[norad] = v
+            return v
         raise KeyError('Unknown satellite {}'.format(norad))
 
+    def get_many(self, norads):
+        """Returns a dict of NORAD number -> TLE for the norads found.
+
+        Each source is asked in order, in bulk, for the ones not found yet
+        and not recently missed by that source.
+        """
+        remaining = list(dict.fromkeys(norads))
+        found = {}
+        for source, d in self.data_source.items():
+            asked = remaining
+            if self.misses is not None:
+                missing = self.misses.missing(source)
+                asked = [norad for norad in remaining if norad not in missing]
+            if not asked:
+                continue
+            v = d.get_many(asked)
+            found.update(v)
+            remaining = [norad for norad in remaining if norad not in v]
+            if self.misses is not None:
+                # requests which failed are not misses
+                failed = getattr(d, 'failed', ())
+                self.misses.add(source, [norad for norad in asked
+                                         if norad not in v
+                                         and norad not in failed])
+        self._data.update(found)
+        return found
+
     def __iter__(self):
         return iter(self._data)
 
@@ -158,20 +521,88 @@ class TLESource(Mapping):
 
 
 class APITLESource(TLESource):
-    """Mapping which fetches TLEs from an API."""
-    def __init__(self, name, template):
+    """Mapping which fetches TLEs from an API.
+
+    get_many() first downloads the group files, whole catalogs of 3-line
+    TLEs, and only looks up the satellites not in them one by one, with
+    `workers` concurrent requests.  Requests share a pool of `workers`
+    connections and are limited to `rate` per second.
+    """
+    def __init__(self, name, template, groups=(), workers=API_WORKERS,
+                 rate=API_RATE):
         """
         name: short string to identify the source
         template: URL template suitable for .format(norad)
+        groups: URLs of files with 3-line groups
         """
         self.name = name
         self.template = template
+        self.groups = tuple(groups)
+        self.workers = workers
         self.client = requests.session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+        self.client.mount('http://', adapter)
+        self.client.mount('https://', adapter)
+        self.limiter = _RateLimiter(rate)
+        self.failed = set()
+        self._groups = None
+
+    def _get(self, url):
+        self.limiter.wait()
+        return self.client.get(url)
+
+    def _group_catalogs(self):
+        """Returns the TLECatalogs of the group files, fetched once.  Files
+        which can not be fetched are skipped.
+        """
+        if self._groups is None:
+            self._groups = []
+            for url in self.groups:
+                try:
+                    r = self._get(url)
+                except requests.RequestException:
+                    continue
+                if r.ok:
+                    self._groups.append(
+                        TLECatalog(r.text.splitlines(), source=self.name))
+        return self._groups
+
+    def _lookup(self, norad):
+        """Returns the TLE of norad, None if there is none or the request
+        failed, those are added to self.failed.
+        """
+        try:
+            return self[norad]
+        except KeyError:
+            return None
+        except requests.RequestException:
+            self.failed.add(norad)
+            return None
+
+    def get_many(self, norads):
+        self.failed = set()
+        found = {}
+        for catalog in self._group_catalogs():
+            found.update((norad, catalog[norad]) for norad in norads
+                         if norad not in found and norad in catalog)
+
+        rest = [norad for norad in norads if norad not in found]
+        with ThreadPoolExecutor(self.workers) as pool:
+            for norad, tle in zip(rest, pool.map(self._lookup, rest)):
+                if tle is not None:
+                    found[norad] = tle
+        return found
 
     def __getitem__(self, norad):
-        r = self.client.get(self.template.format(norad))
+        for catalog in self._groups or ():
+            if norad in catalog:
+                return catalog[norad]
+        r = self._get(self.template.format(norad))
+        # a failed or rate limited request is not a miss
+        r.raise_for_status()
         p = html.fromstring(r.text)
-        lines = p.xpath('//pre/text()')[0].split('\n')
+        pre = p.xpath('//pre/text()')
+        lines = pre[0].split('\n') if pre else []
         if len(lines) == 6:
             t = (lines[1].strip(), lines[2].strip(), lines[3].strip())
             return TLE(t, source=self.name)
@@ -180,7 +611,12 @@ class APITLESource(TLESource):
 
 
 class FileTLESource(TLESource):
-    """Mapping which reads TLEs from text files with 3 lines per satellite."""
+    """Mapping which reads TLEs from text files with 3 lines per satellite.
+
+    reload() only fetches files which changed, by ETag and Last-Modified
+    for files served via http and by modification time for local ones, and
+    only parses the TLEs which changed.
+    """
     def __init__(self, name, fname):
         """
         name: short string to identify the source
@@ -188,40 +624,189 @@ class FileTLESource(TLESource):
         """
         self.name = name
         self.fname = fname
-        self._data = self.read_3LE(fname)
+        # the conditional requests of reload() need to reach the server
+        # rather than the module's response cache
+        with requests_cache.disabled():
+            self.client = requests.session()
+        # fname -> (ETag, Last-Modified) or (mtime, size) of the last fetch
+        self._validators = {}
+        self._data = TLECatalog(source=name)
+        self.reload()
 
     def __getitem__(self, norad):
         return self._data[norad]
 
-    def _get_fp(self, fname):
-        """Return a file-like object to a local file or one served via http."""
-        if fname.startswith('http'):
-            r = requests.get(fname)
-            return StringIO(r.text)
-        elif isinstance(fname, file):
+    def get_many(self, norads):
+        return {norad: self._data[norad] for norad in norads
+                if norad in self._data}
+
+    def _get_fp(self, fname, conditional=False):
+        """Return an iterable of the lines of a file-like object, a local
+        file or one served via http.
+
+        With `conditional`, returns None when the file did not change since
+        it was last fetched.
+        """
+        if isinstance(fname, IOBase):
             return fname
-        elif isinstance(fname, str):
-            return open(fname)
-        else:
+        elif not isinstance(fname, str):
             raise TypeError('Unhandled type {}'.format(type(fname)))
 
+        if fname.startswith('http'):
+            etag, modified = self._validators.get(fname, (None, None))
+            headers = {}
+            if conditional and etag:
+                headers['If-None-Match'] = etag
+            if conditional and modified:
+                headers['If-Modified-Since'] = modified
+            r = self.client.get(fname, headers=headers, stream=True)
+            validators = (r.headers.get('ETag'),
+                          r.headers.get('Last-Modified'))
+            if conditional and (r.status_code == 304
+                                or (any(validators)
+                                    and validators == (etag, modified))):
+                r.close()
+                return None
+            if r.ok:
+                self._validators[fname] = validators
+            r.encoding = r.encoding or 'utf-8'
+            return r.iter_lines(decode_unicode=True)
+
+        st = os.stat(fname)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if conditional and self._validators.get(fname) == stamp:
+            return None
+        self._validators[fname] = stamp
+        return open(fname)
+
     def read_3LE(self, fname):
+        """Returns a TLECatalog of the TLEs in fname."""
         fp = self._get_fp(fname)
-        data = {}
-        file_iter= iter(fp)
-        while file_iter:
-            triple = islice(file_iter, 3)
-            lines = [x.rstrip() for x in triple]
-            if len(lines) == 3:
-                tle = TLE(lines, source=self.name)
-                data[tle.norad] = tle
-            else:
-                break
-        return data
+        try:
+            return TLECatalog(fp, source=self.name)
+        finally:
+            if fp is not fname:
+                fp.close()
 
     def reload(self, fname=None):
-        """Re-fetch the file to possibly get new data."""
-        self._data = self.read_3LE(fname if fname else self.fname)
+        """Re-fetch the file if it changed and apply the new and changed
+        TLEs.  TLEs no longer in the file are kept.
+
+        Returns the set of NORAD numbers added or changed.
+        """
+        fname = fname if fname else self.fname
+        fp = self._get_fp(fname, conditional=True)
+        if fp is None:
+            return set()
+        try:
+            return self._data.update(iter_3le(fp))
+        finally:
+            if fp is not fname:
+                fp.close()
+
+
+def create_tle_table(cur):
+    """Creates the tle table of TLE downloads and its indexes if missing.
+
+    The (norad, downloaded) index lets latest_tles() find the newest row of
+    each satellite without reading its history.
+    """
+    cur.execute('''CREATE TABLE IF NOT EXISTS tle
+                (norad integer,
+                 epoch timestamp,
+                 line0 text,
+                 line1 text,
+                 line2 text,
+                 downloaded timestamp,
+                 unique(norad, epoch)
+                );''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS idx_tle_downloaded
+                   ON tle (norad, downloaded);''')
+    _migrate_tle_epochs(cur)
+
+
+def _migrate_tle_epochs(cur):
+    """Rewrites the epochs of a tle table written before TLE.epoch counted
+    the day of the year from 1.0, which are one day late, from their lines.
+
+    The same TLE downloaded again since then has a second row with the right
+    epoch, the late row is dropped.  Runs once, the PRAGMA user_version of
+    the database is then TLE_DB_VERSION, and is committed so that other
+    connections to the database can write.
+    """
+    version, = cur.execute('PRAGMA user_version;').fetchone()
+    if version >= TLE_DB_VERSION:
+        return
+    rows = cur.execute('''SELECT rowid, line0, line1, line2 FROM tle
+                          ORDER BY norad, epoch;''').fetchall()
+    # in order of epoch, so a row never moves onto a late one not yet moved
+    duplicates = []
+    for rowid, *lines in rows:
+        cur.execute('UPDATE OR IGNORE tle SET epoch = ? WHERE rowid = ?;',
+                    (TLE(lines).epoch, rowid))
+        if cur.rowcount == 0:
+            duplicates.append((rowid,))
+    cur.executemany('DELETE FROM tle WHERE rowid = ?;', duplicates)
+    cur.execute('PRAGMA user_version = {};'.format(TLE_DB_VERSION))
+    cur.connection.commit()
+
+
+def latest_tles(cur, norads):
+    """Returns a dict of NORAD number -> newest downloaded row of the tle
+    table, for the norads which have one.
+
+    All norads are looked up in one query, one index search each.
+    """
+    query = '''SELECT tle.* FROM json_each(?) AS wanted
+               JOIN tle ON tle.rowid = (
+                   SELECT rowid FROM tle
+                   WHERE norad = wanted.value
+                   ORDER BY downloaded DESC
+                   LIMIT 1)'''
+    rows = cur.execute(query, (json.dumps([int(n) for n in norads]),))
+    return {row[0]: row for row in rows}
+
+
+def _as_of_time(t, by):
+    """Returns time t as text comparable with the `by` column of the tle
+    table.  Strings are ISO 8601, naive datetimes are UTC.
+    """
+    if isinstance(t, str):
+        t = datetime.fromisoformat(t.replace('Z', '+00:00'))
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    t = t.astimezone(timezone.utc)
+    # epochs are stored as aware datetimes, downloads as naive UTC ones
+    return str(t if by == 'epoch' else t.replace(tzinfo=None))
+
+
+def tles_as_of(cur, pairs, by='epoch'):
+    """Returns the rows of the tle table current at the given times.
+
+    pairs: iterable of (norad, time), times are datetimes or ISO 8601 strings
+    by: 'epoch' for the TLE with the newest epoch at or before each time,
+        the best elements for the time.  'downloaded' for the newest one
+        downloaded at or before each time, what was known then.
+
+    All pairs are looked up in one query, one index search each.  Returns a
+    list with a (norad, line0, line1, line2) row, or None when there is no
+    TLE, for each pair.
+    """
+    if by not in ('epoch', 'downloaded'):
+        raise ValueError('Unknown TLE time column {!r}'.format(by))
+    pairs = [(int(norad), _as_of_time(t, by)) for norad, t in pairs]
+    query = '''SELECT wanted.key, tle.norad, tle.line0, tle.line1, tle.line2
+               FROM json_each(?) AS wanted
+               JOIN tle ON tle.rowid = (
+                   SELECT rowid FROM tle
+                   WHERE norad = json_extract(wanted.value, '$[0]')
+                     AND {0} <= json_extract(wanted.value, '$[1]')
+                   ORDER BY {0} DESC
+                   LIMIT 1)'''.format(by)
+    found = [None] * len(pairs)
+    for row in cur.execute(query, (json.dumps(pairs),)):
+        found[row[0]] = row[1:]
+    return found
 
 
 class SqliteTLESource(TLESource):
@@ -237,20 +822,36 @@ class SqliteTLESource(TLESource):
         self.cur = self.conn.cursor()
 
     def __getitem__(self, norad):
-        query = '''SELECT * FROM tle
-                     WHERE norad = ?
-                     ORDER BY downloaded DESC
-                     LIMIT 1'''
-        data = self.cur.execute(query, (norad,)).fetchone()
+        data = latest_tles(self.cur, [norad]).get(norad)
         if data is not None:
             return TLE((data['line0'], data['line1'], data['line2']), source=self.name)
         else:
             raise KeyError('{} not found'.format(norad))
 
+    def get_many(self, norads):
+        return {norad: TLE((data['line0'], data['line1'], data['line2']),
+                           source=self.name)
+                for norad, data in latest_tles(self.cur, norads).items()}
+
+    def as_of(self, norad, t, by='epoch'):
+        """Returns the TLE of norad current at time t, see tles_as_of()."""
+        data = tles_as_of(self.cur, [(norad, t)], by)[0]
+        if data is None:
+            raise KeyError('{} not found before {}'.format(norad, t))
+        return TLE(data[1:], source=self.name)
+
+    def as_of_many(self, pairs, by='epoch'):
+        """Returns the TLE current at the time of each (norad, time) pair,
+        None where there is none, see tles_as_of().
+        """
+        return [None if data is None else TLE(data[1:], source=self.name)
+                for data in tles_as_of(self.cur, pairs, by)]
+
 
 # ordered by fallback priority
 TLE_SOURCES = (
-    ('CelesTrak', APITLESource, 'http://www.celestrak.com/satcat/tle.php?CATNR={}'),
+    ('CelesTrak', APITLESource, config['CelesTrak']['tle_url'],
+     config['CelesTrak']['tle_groups'].split()),
     ('AMSAT', FileTLESource, 'https://www.amsat.org/tle/current/nasabare.txt'),
     ('CalPolyMSTL', FileTLESource, 'http://mstl.atl.calpoly.edu/~ops/keps/kepler.txt'),
     ('LocalSqliteDB', SqliteTLESource, config['DEFAULT']['tle_db']),
@@ -258,62 +859,161 @@ TLE_SOURCES = (
 
 
 
-def get_stations(outfile=None, networks=None):
+def _fetch_pages(client, url, workers=STATION_WORKERS):
+    """Returns the concatenated JSON lists of all pages of an API endpoint.
+
+    Pages numbered with a 'page' query parameter are fetched `workers` at a
+    time, ahead of the 'next' links, others by following the links.
+    """
+    r = client.get(url)
+    data = r.json()
+    nextpage = r.links.get('next')
+    if not nextpage:
+        return data
+
+    parts = urlsplit(nextpage['url'])
+    query = parse_qs(parts.query)
+    if not query.get('page', [''])[0].isdigit():
+        while nextpage:
+            r = client.get(nextpage['url'])
+            data.extend(r.json())
+            nextpage = r.links.get('next')
+        return data
+
+    def page_url(page):
+        query['page'] = [str(page)]
+        return urlunsplit(parts._replace(query=urlencode(query, doseq=True)))
+
+    page = int(query['page'][0])
+    with ThreadPoolExecutor(workers) as pool:
+        while True:
+            urls = [page_url(p) for p in range(page, page + workers)]
+            for r in pool.map(client.get, urls):
+                # pages past the last one are not found
+                if not r.ok:
+                    return data
+                data.extend(r.json())
+                if not r.links.get('next'):
+                    return data
+            page += workers
+
+
+def _fetch_stations(network):
+    """Returns the list of station dicts of a configured network."""
+    url = config[network]['stations_url']
+
+    if url.startswith('http'):
+        data = _fetch_pages(requests.session(), url)
+    elif os.path.isfile(url):
+        data = json.load(open(url))
+    else:
+        raise TypeError('Unknown protocol for: {}'.format(url))
+
+    for gs in data:
+        # normalize keys
+        # SatNOGS v1 uses 'lng' for longitude
+        if 'lon' not in gs:
+            gs['lon'] = gs.get('lng') or gs.get('longitude')
+
+        # SatNOGS v1 uses 'altitude' for station height above sea level
+        if 'alt' not in gs:
+            gs['alt'] = gs.get('altitude') or gs.get('elevation')
+
+        # verify sufficient information is present
+        for k in STATION_KEYS:
+            if k not in gs:
+                raise KeyError('Missing key: {}'.format(k))
+    return data
+
+
+def station_hash(gs):
+    """Returns a hash of the station information passes depend on, the
+    STATION_KEYS.
+    """
+    data = json.dumps([gs.get(k) for k in STATION_KEYS])
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_stations(outfile=None, networks=None, feed=None):
     """
     Utility to get download / get station information from the configured
     networks.  Collects into a single dict.  Returns the dict and also writes
     to a JSON file for later retrieval.
+
+    The networks and the pages of each are fetched concurrently.  Stations
+    are compared with those already in the file by station_hash(), and the
+    file is only rewritten when stations were added, changed or removed.
+    These changes are appended to the JSON lines `feed`, by default next to
+    outfile with a '-feed.jsonl' suffix, see station_changes().
     """
     outfile = outfile or config['DEFAULT']['stations_file']
+    feed = feed or os.path.splitext(outfile)[0] + '-feed.jsonl'
 
     # default to reading stations from all networks
     if networks is None:
-        networks = config.sections()
+        networks = [network for network in config.sections()
+                    if 'stations_url' in config[network]]
 
     stations = {}
-    for network in networks:
-        url = config[network]['stations_url']
-
-        if url.startswith('http'):
-            client = requests.session()
-            r = client.get(url)
-            data = r.json()
+    with ThreadPoolExecutor(max(len(networks), 1)) as pool:
+        for data in pool.map(_fetch_stations, networks):
+            for gs in data:
+                # TODO: better to use 'network/id'?  What about GS on multiple networks?
+                # key = '/'.join((config['network_name'], gs['id']))
+                #key = gs['name']
+                key = gs['id']
+                stations[key] = gs
 
-            nextpage = r.links.get('next')
-            while nextpage:
-                r = client.get(nextpage['url'])
-                data.extend(r.json())
-                nextpage = r.links.get('next')
-        elif os.path.isfile(url):
-            data = json.load(open(url))
-        else:
-            raise TypeError('Unknown protocol for: {}'.format(url))
-
-        for gs in data:
-            # normalize keys
-            # SatNOGS v1 uses 'lng' for longitude
-            if 'lon' not in gs:
-                gs['lon'] = gs.get('lng') or gs.get('longitude')
-
-            # SatNOGS v1 uses 'altitude' for station height above sea level
-            if 'alt' not in gs:
-                gs['alt'] = gs.get('altitude') or gs.get('elevation')
+    try:
+        with open(outfile) as fp:
+            old = json.load(fp)
+    except FileNotFoundError:
+        old = None
+    old_hashes = {key: station_hash(gs) for key, gs in (old or {}).items()}
+    new_hashes = {str(key): station_hash(gs) for key, gs in stations.items()}
+
+    now = datetime.now(timezone.utc).isoformat()
+    changes = []
+    for key, h in new_hashes.items():
+        if key not in old_hashes:
+            changes.append({'change': 'added', 'id': key, 'hash': h})
+        elif old_hashes[key] != h:
+            changes.append({'change': 'changed', 'id': key, 'hash': h})
+    for key in old_hashes.keys() - new_hashes.keys():
+        changes.append({'change': 'removed', 'id': key, 'hash': None})
+
+    if changes or old is None:
+        with open(outfile, 'w') as fp:
+            json.dump(stations, fp, sort_keys=True, indent=2)
+
+    if changes:
+        with open(feed, 'a') as fp:
+            for change in changes:
+                change['time'] = now
+                fp.write(json.dumps(change, sort_keys=True) + '\n')
 
-            # verify sufficient information is present
-            for k in STATION_KEYS:
-                if k not in gs:
-                    raise KeyError('Missing key: {}'.format(k))
+    return stations
 
-            # TODO: better to use 'network/id'?  What about GS on multiple networks?
-            # key = '/'.join((config['network_name'], gs['id']))
-            #key = gs['name']
-            key = gs['id']
-            stations[key] = gs
 
-    with open(outfile, 'w') as fp:
-        json.dump(stations, fp, sort_keys=True, indent=2)
+def station_changes(feed=None, since=None):
+    """Returns the station changes recorded by get_stations().
 
-    return stations
+    Each change is a dict with 'time' (ISO 8601), 'change' ('added',
+    'changed' or 'removed'), the station 'id' and its new 'hash'.  With
+    `since`, an ISO 8601 string as in 'time', only the later changes.
+    The default feed is the one of the configured 'stations_file'.
+    """
+    if feed is None:
+        outfile = config['DEFAULT']['stations_file']
+        feed = os.path.splitext(outfile)[0] + '-feed.jsonl'
+    try:
+        with open(feed) as fp:
+            changes = [json.loads(line) for line in fp if line.strip()]
+    except FileNotFoundError:
+        return []
+    if since is not None:
+        changes = [c for c in changes if c['time'] > since]
+    return changes
 
 
 def load_stations(filename=None, from_cache=True):
@@ -367,13 +1067,9 @@ def load_satellites(satsfile=None, tledb=None):
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
 
-    def get_info(norad):
-        query = 'SELECT * FROM tle WHERE norad = ? ORDER BY downloaded DESC LIMIT 1'
-        cur.execute(query, (norad,))
-        return cur.fetchone()
-
+    rows = latest_tles(cur, sats)
     for norad, sat in sats.items():
-        row = get_info(norad)
+        row = rows.get(norad)
         if not row:
             continue
 
@@ -384,6 +1080,44 @@ def load_satellites(satsfile=None, tledb=None):
     return d
 
 
+def load_tle_history(satellites, start_time, duration=None, tledb=None):
+    """Add the TLEs from tledb which are valid during a window to satellites.
+
+    Each satellite dict gets a 'tles' list, ordered by epoch, of the last TLE
+    with an epoch before start_time and all those with epochs in the next
+    `duration` hours (all later ones without a duration).  The vectorized
+    compute_passes_*() functions then switch between them, see
+    predict.HistoryPropagator.  Satellites without any TLE in tledb are left
+    alone.
+    """
+    tledb = tledb or config['DEFAULT']['tle_db']
+    start = ephem.date(start_time).datetime().replace(tzinfo=timezone.utc)
+    end = None if duration is None else start + timedelta(hours=duration)
+
+    conn = sqlite3.connect('file:' + tledb + '?mode=ro', uri=True)
+    cur = conn.cursor()
+    # only the window's rows, ranged on the (norad, epoch) index
+    query = '''SELECT line0, line1, line2 FROM tle
+               WHERE norad = :norad
+                 AND epoch >= coalesce((SELECT max(epoch) FROM tle
+                                        WHERE norad = :norad
+                                          AND epoch <= :start), :start)'''
+    window = {'start': _as_of_time(start, 'epoch')}
+    if end is not None:
+        query += ' AND epoch < :end'
+        window['end'] = _as_of_time(end, 'epoch')
+    for sat in satellites:
+        tles = sorted((TLE(row) for row in cur.execute(
+                          query, dict(window, norad=sat['norad_cat_id']))),
+                      key=lambda tle: tle.epoch)
+        before = [tle for tle in tles if tle.epoch <= start][-1:]
+        during = [tle for tle in tles
+                  if tle.epoch > start and (end is None or tle.epoch < end)]
+        if before or during:
+            sat['tles'] = [tle.lines for tle in before + during]
+    conn.close()
+
+
 
 def load_observations(obsfile=None):
     """Load a, possibly compressed, file of JSON observations."""
@@ -545,6 +1279,93 @@ class ObservationsDB(dict):
         self.db_conn.close()
 
 
+class PassCache:
+    """Persistent cache of the passes of station--satellite pairs.
+
+    Entries are keyed by a hash of everything the passes depend on: the TLE
+    lines, station location and horizon, compute function and time window.
+    They never go stale, so there is nothing to invalidate.  When the passes
+    stored take more than `max_size` bytes, the least recently used entries
+    are removed by close().
+    """
+    def __init__(self, filename=None, max_size=CACHE_SIZE):
+        filename = filename or config['DEFAULT']['passes_cache']
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect('file:' + filename, uri=True)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS passes_cache
+                  (key text PRIMARY KEY,
+                  passes blob,
+                  size integer,
+                  used real);''')
+        self.conn.execute('''CREATE INDEX IF NOT EXISTS idx_used
+                             ON passes_cache (used);''')
+        self.conn.commit()
+
+    @staticmethod
+    def key(observer, satellite, engine, start, end):
+        """Returns the hex digest identifying the passes of a pair."""
+        data = [
+            satellite['tle'][1],
+            satellite['tle'][2],
+            observer['lat'],
+            observer['lon'],
+            observer['altitude'],
+            observer['min_horizon'],
+            engine,
+            start.isoformat(),
+            end.isoformat(),
+        ]
+        if satellite.get('tles'):
+            data.append([tle[1:] for tle in satellite['tles']])
+        data = json.dumps(data)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def get(self, key):
+        """Returns the list of pass tuples stored under key, or None.
+
+        The tuples are PassTuple without the gs and norad fields.
+        """
+        row = self.conn.execute('''SELECT passes FROM passes_cache
+                                   WHERE key = ?;''', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute('''UPDATE passes_cache SET used = ?
+                             WHERE key = ?;''', (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key, passes):
+        """Stores a list of PassTuple, which all belong to the same pair."""
+        blob = pickle.dumps([tuple(p[:7]) for p in passes])
+        self.conn.execute('''INSERT OR REPLACE INTO passes_cache
+                             VALUES (?,?,?,?);''',
+                          (key, blob, len(blob), time.time()))
+
+    def evict(self):
+        """Removes the least recently used entries above max_size bytes."""
+        total = self.conn.execute('''SELECT total(size)
+                                     FROM passes_cache;''').fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self.conn.execute('''SELECT key, size FROM passes_cache
+                                    ORDER BY used;''').fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            self.conn.execute('''DELETE FROM passes_cache
+                                 WHERE key = ?;''', (key,))
+            total -= size
+
+    def close(self):
+        self.evict()
+        self.conn.commit()
+        self.conn.close()
+
+
 def passrow2interval(p):
     data = PassTuple(**p)
     return Interval(data.start, data.end, data)
@@ -573,37 +1394,313 @@ def getpasses(passes_db=None, gs=None, sat=None, start=None, end=None):
     -------
     IntervalTree
         All matching passes from the database with `.data` set to a `PassTuple`.
+
+    The passes of the last PASSES_CACHE_SIZE queries are kept while the
+    database file is unchanged, so a repeated query skips the database.
+    Each call still returns a new tree which the caller may modify.
     """
     passes_db = passes_db or config['DEFAULT']['passes_db']
-    tree = IntervalTree()
+    key = (os.path.abspath(passes_db), _passes_version(passes_db),
+           gs, sat, start, end)
+    with _passes_lock:
+        passes = _passes_cache.get(key)
+        if passes is not None:
+            _passes_cache.move_to_end(key)
+            return IntervalTree(passes)
+
+    # Intervals and PassTuples are immutable, so trees can share them
+    passes = tuple(iterpasses(passes_db, gs, sat, start, end,
+                              ordered=False))
+    with _passes_lock:
+        _passes_cache[key] = passes
+        while len(_passes_cache) > PASSES_CACHE_SIZE:
+            _passes_cache.popitem(last=False)
+    return IntervalTree(passes)
+
+
+# read-only connections to passes databases by (path, thread), and the
+# getpasses() passes by (path, version, arguments), least recently used first
+_passes_connections = {}
+_passes_cache = OrderedDict()
+_passes_lock = threading.Lock()
+
+
+def _passes_version(passes_db):
+    """Returns the inode, size and modification time of a passes database and
+    of its write-ahead log, which change whenever it is written.
+    """
+    version = ()
+    for name in (passes_db, passes_db + '-wal'):
+        try:
+            st = os.stat(name)
+        except FileNotFoundError:
+            continue
+        version += (st.st_ino, st.st_size, st.st_mtime_ns)
+    return version
 
-    conn = sqlite3.connect('file:' + passes_db + '?mode=ro',
-                           uri=True,
-                           detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.row_factory = sqlite3.Row
 
-    query = 'SELECT * FROM passes'
+def _passes_connection(passes_db):
+    """Returns the read-only connection of this thread to a passes database,
+    opened on first use and again when the file was replaced.
+    """
+    key = (os.path.abspath(passes_db), threading.get_ident())
+    inode = os.stat(passes_db).st_ino
+    conn, opened = _passes_connections.get(key, (None, None))
+    if conn is None or opened != inode:
+        if conn is not None:
+            conn.close()
+        conn = sqlite3.connect('file:' + passes_db + '?mode=ro',
+                               uri=True,
+                               detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.row_factory = sqlite3.Row
+        _passes_connections[key] = (conn, inode)
+    return conn
+
+
+def clear_passes_cache():
+    """Forgets the cached getpasses() results and closes the connections of
+    this thread to passes databases.
+    """
+    with _passes_lock:
+        _passes_cache.clear()
+    thread = threading.get_ident()
+    for key in [key for key in _passes_connections if key[1] == thread]:
+        _passes_connections.pop(key)[0].close()
+
+
+def iterpasses(passes_db=None, gs=None, sat=None, start=None, end=None,
+               ordered=True):
+    """Yields the passes getpasses() would return, one at a time.
+
+    The passes are Intervals with `.data` set to a `PassTuple`, in order of
+    start time unless `ordered` is False.  They are read from the database
+    as they are consumed, without building an IntervalTree, so a year of
+    passes streams in constant memory when the idx_start, idx_gs_start or
+    idx_norad_start index lets SQLite skip sorting them.
+    """
+    passes_db = passes_db or config['DEFAULT']['passes_db']
+
+    conn = _passes_connection(passes_db)
+    query, args = _passes_query(conn, gs, sat, start, end, ordered)
+    for p in conn.execute(query, args):
+        yield passrow2interval(p)
+
+
+_GLOB_CHARS = frozenset('*?[')
+
+
+def _passes_query(conn, gs, sat, start, end, ordered=False):
+    """Returns the query and its arguments which select the passes of
+    getpasses(), in order of start time if `ordered`.
+    """
+    indexed = _passes_time_indexed(conn)
+
+    query = 'SELECT passes.* FROM passes'
     args = []
     conditions = []
-    for (name, var) in (('gs', gs), ('sat', sat),):
-        if var is not None:
+    for (name, var) in (('gs', gs), ('norad', sat),):
+        if var is None:
+            continue
+        # a plain name or number is matched with = so that the
+        # (gs, start) and (norad, start) indexes also give the order
+        pattern = str(var)
+        if _GLOB_CHARS.intersection(pattern):
             conditions.append('{} GLOB ?'.format(name))
-            args.append(var)
+        else:
+            conditions.append('{} = ?'.format(name))
+            if name == 'norad' and pattern.isdigit():
+                pattern = int(pattern)
+        args.append(pattern)
+
+    # return passes which overlap the end points, the time index selects a
+    # superset of them by whole seconds.  Ordered, it bounds start from below
+    # by the earliest overlapping pass instead, so that an index on start
+    # walks the window in order unsorted; without a start, start <= end
+    # already ranges that index.
+    if indexed and (start is not None or (end is not None and not ordered)):
+        window = []
+        if start is not None:
+            window.append('end_ts >= ' + _EPOCH_SECONDS.format('?'))
+            args.append(start)
+        if end is not None:
+            window.append('start_ts <= ' + _EPOCH_SECONDS.format('?'))
+            args.append(end)
+        window = ' WHERE ' + ' AND '.join(window)
+        if ordered:
+            conditions.append(
+                "start >= (SELECT datetime(min(start_ts) + {:d}, 'unixepoch')"
+                " FROM passes_time{})".format(
+                    int(PASSES_TIME_EPOCH.timestamp()), window))
+        else:
+            conditions.append('passes.rowid IN (SELECT id FROM passes_time'
+                              + window + ')')
 
-    # return passes which overlap the end points
     if start is not None:
-        conditions.append("end >= datetime('{}')".format(start))
+        conditions.append('end >= datetime(?)')
+        args.append(start)
 
     if end is not None:
-        conditions.append("start <= datetime('{}')".format(end))
+        conditions.append('start <= datetime(?)')
+        args.append(end)
 
     if conditions:
         query += ' WHERE ' + ' AND '.join(conditions)
+    if ordered:
+        query += ' ORDER BY start'
+    return query, args
 
-    for p in conn.execute(query, args):
-        tree.add(passrow2interval(p))
-    conn.close()
-    return tree
+
+def _datetime64(t):
+    """Returns time t as a datetime64[us] of naive UTC, as the PassStore
+    columns are.  Strings are ISO 8601, aware datetimes are converted.
+    """
+    if isinstance(t, str):
+        t = datetime.fromisoformat(t.replace('Z', '+00:00'))
+    if t.tzinfo is not None:
+        t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(t, 'us')
+
+
+class PassStore(Sequence):
+    """Columnar store of many passes, sorted by start time.
+
+    The passes are in `data`, a NumPy structured array of PASS_DTYPE, and
+    are only turned into PassTuple when indexed or iterated.  `stations` is
+    the list of ground station names which the gs column indexes.
+
+    A store is saved as a .npy file of `data` plus a .json sidecar of the
+    station names, and loaded memory-mapped, so opening one costs nothing
+    until rows are read.  query() finds time windows by binary search on
+    the start times.
+    """
+    def __init__(self, data, stations, max_duration=None):
+        """
+        data: PASS_DTYPE array sorted by start
+        stations: list of station names, by gs column value
+        max_duration: longest end - start in data, as timedelta64
+        """
+        self.data = data
+        self.stations = list(stations)
+        if max_duration is None:
+            max_duration = ((data['end'] - data['start']).max()
+                            if len(data) else np.timedelta64(0, 'us'))
+        self.max_duration = max_duration
+
+    @classmethod
+    def from_passes(cls, passes):
+        """Returns the store of an iterable of PassTuple."""
+        passes = list(passes)
+        stations = sorted({p.gs for p in passes})
+        code = {name: i for i, name in enumerate(stations)}
+        data = np.empty(len(passes), dtype=PASS_DTYPE)
+        for i, name in enumerate(PassTuple._fields):
+            column = [p[i] for p in passes]
+            data[name] = ([code[gs] for gs in column] if name == 'gs'
+                          else column)
+        data.sort(order='start', kind='stable')
+        return cls(data, stations)
+
+    @classmethod
+    def from_db(cls, passes_db=None):
+        """Returns the store of all passes in a database of passes."""
+        passes_db = passes_db or config['DEFAULT']['passes_db']
+        conn = sqlite3.connect('file:' + passes_db + '?mode=ro', uri=True)
+        columns = ', '.join(PassTuple._fields)
+        rows = conn.execute('SELECT ' + columns + ' FROM passes'
+                            ' ORDER BY start;').fetchall()
+        conn.close()
+
+        data = np.empty(len(rows), dtype=PASS_DTYPE)
+        if rows:
+            for name, column in zip(PassTuple._fields, zip(*rows)):
+                if name != 'gs':
+                    data[name] = column
+            stations, data['gs'] = np.unique([row[7] for row in rows],
+                                             return_inverse=True)
+        else:
+            stations = []
+        return cls(data, stations)
+
+    def save(self, filename):
+        """Writes the store to filename, a .npy file, and the station names
+        next to it in a .json file of the same name.
+        """
+        np.save(filename, self.data)
+        sidecar = os.path.splitext(filename)[0] + '.json'
+        with open(sidecar, 'w') as f:
+            json.dump({
+                'stations': self.stations,
+                'max_duration': int(self.max_duration
+                                    / np.timedelta64(1, 'us')),
+            }, f)
+
+    @classmethod
+    def load(cls, filename):
+        """Returns the store saved to filename, memory-mapped read-only."""
+        data = np.load(filename, mmap_mode='r')
+        sidecar = os.path.splitext(filename)[0] + '.json'
+        with open(sidecar) as f:
+            meta = json.load(f)
+        return cls(data, meta['stations'],
+                   np.timedelta64(meta['max_duration'], 'us'))
+
+    def query(self, gs=None, sat=None, start=None, end=None):
+        """Returns a store of the matching passes, as getpasses() selects
+        them.
+
+        gs: glob string selecting ground station names
+        sat: NORAD number or glob string selecting satellites
+        start: datetime or ISO 8601 string, passes which end on or after it
+        end: datetime or ISO 8601 string, passes which start on or before it
+
+        Naive times are UTC, as in the database.
+        """
+        starts = self.data['start']
+        lo, hi = 0, len(starts)
+        # passes ending after start began at most max_duration before it
+        if start is not None:
+            start = _datetime64(start)
+            lo = np.searchsorted(starts, start - self.max_duration, 'left')
+        if end is not None:
+            hi = np.searchsorted(starts, _datetime64(end), 'right')
+        data = self.data[lo:max(lo, hi)]
+
+        mask = np.ones(len(data), dtype=bool)
+        if start is not None:
+            mask &= data['end'] >= start
+        if gs is not None:
+            codes = [i for i, name in enumerate(self.stations)
+                     if fnmatchcase(name, gs)]
+            mask &= np.isin(data['gs'], codes)
+        if sat is not None:
+            norads = np.unique(data['norad'][mask])
+            norads = [n for n in norads if fnmatchcase(str(n), str(sat))]
+            mask &= np.isin(data['norad'], norads)
+        if not mask.all():
+            data = data[mask]
+        return PassStore(data, self.stations, self.max_duration)
+
+    def tree(self):
+        """Returns an IntervalTree of the passes, as getpasses() does."""
+        return IntervalTree(Interval(p.start, p.end, p) for p in self)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return PassStore(self.data[i], self.stations, self.max_duration)
+        row = self.data[i]
+        return PassTuple(
+            start=row['start'].item(),
+            end=row['end'].item(),
+            duration=float(row['duration']),
+            rise_az=float(row['rise_az']),
+            set_az=float(row['set_az']),
+            tca=row['tca'].item(),
+            max_el=float(row['max_el']),
+            gs=self.stations[row['gs']],
+            norad=int(row['norad']))
+
+    def __len__(self):
+        return len(self.data)
 
 
 def compute_passes_ephem(args):
@@ -624,6 +1721,7 @@ def compute_passes_ephem(args):
     (observer, satellite, start_time, num_passes, duration) = args
     # s = "%s <--> %s | " % (observer['name'], satellite['name'].strip())
     s = "%3i <--> %5i | " % (observer['id'], satellite['norad_cat_id'])
+    head = len(s)
 
     tle_line0, tle_line1, tle_line2 = satellite['tle']
 
@@ -682,7 +1780,9 @@ def compute_passes_ephem(args):
             s += 'E'
             print(s)
             # print('pyephem: ValueError')
-            return []
+            data = PassList()
+            data.codes = 'E'
+            return data
 
         # check None indicating libastro NORISE, NOSET, NOTRANS flags
         if not all(info):
@@ -730,7 +1830,8 @@ def compute_passes_ephem(args):
 
     print(s)
     # convert to namedtuples since the info doesn't change
-    data = []
+    data = PassList()
+    data.codes = s[head:].replace('.', '')
     for p in contacts:
         d = PassTuple(**p)
         data.append(d)
@@ -765,7 +1866,9 @@ def compute_passes_orbital(args):
         # pyorbital doesn't implement the SDP4 for orbital periods >225 minutes
         # considered deep-space or not near-earth by NORAD
         print('*** deep space')
-        return []
+        data = PassList()
+        data.codes = 'E'
+        return data
 
     start_time = ephem.date(start_time).datetime()
 
@@ -780,7 +1883,9 @@ def compute_passes_orbital(args):
     except Exception:
         # or just plain crashed
         print('*** crash')
-        return []
+        data = PassList()
+        data.codes = 'E'
+        return data
 
     contacts = []
     for rise, fall, maxtime in passes:
@@ -818,34 +1923,183 @@ def compute_passes_orbital(args):
         }
         contacts.append(pass_data)
     # convert to namedtuples since the info doesn't change
-    data = []
+    data = PassList()
     for p in contacts:
         d = PassTuple(**p)
         data.append(d)
     return data
 
 
-def compute_all_passes(stations, satellites, start_time,
-                       passes_db=None,
-                       num_passes=None, duration=None,
-                       num_processes=4,
-                       compute_function=compute_passes_ephem):
-    """Finds passes for all combinations of stations and satellites.
+def _compute_passes_vectorized(args, find_passes, **kwargs):
+    """Common part of the compute_passes_*() functions using satbazaar.predict.
 
-    Saves the pass info as rows in an sqlite3 database and returns the data as
-    an IntervalTree with each data member set to the pass info as a namedtuple.
+    Returns the list of PassTuple, the progress string, and the Propagator.
+    """
+    (observer, satellite, start_time, num_passes, duration) = args
 
-    num_processes > 1 (default: 4) will use a parallel map() for computation.
+    if isinstance(observer, Mapping):
+        observers = [observer]
+        s = "%3i <--> %5i | " % (observer['id'], satellite['norad_cat_id'])
+    else:
+        observers = list(observer)
+        s = "%3i GS <--> %5i | " % (len(observers), satellite['norad_cat_id'])
+
+    if duration is None and num_passes is None:
+        duration = 24
+
+    start = ephem.date(start_time).datetime()
+    if satellite.get('tles'):
+        end = None
+        if duration is not None:
+            end = start + timedelta(hours=duration)
+        prop = predict.HistoryPropagator(satellite['tles'], start, end)
+    else:
+        prop = predict.Propagator(satellite['tle'], start)
+    pos, rot = predict.station_frames([gs['lat'] for gs in observers],
+                                      [gs['lon'] for gs in observers],
+                                      [gs['altitude'] for gs in observers])
+
+    found = find_passes(
+        prop, pos, rot, [gs['min_horizon'] for gs in observers],
+        duration=None if duration is None else duration * 3600.0,
+        num_passes=num_passes,
+        **kwargs)
+
+    data = PassList()
+    data.calls = prop.calls
+    if prop.errors:
+        # propagator failed for part of the interval, e.g. a decayed orbit
+        s += 'E'
+        data.codes = 'E'
+    for i in range(len(found['station'])):
+        rise = float(found['rise'][i])
+        fall = float(found['set'][i])
+        d = PassTuple(
+            start=start + timedelta(seconds=rise),
+            end=start + timedelta(seconds=fall),
+            duration=fall - rise,
+            rise_az=float(found['rise_az'][i]),
+            set_az=float(found['set_az'][i]),
+            tca=start + timedelta(seconds=float(found['tca'][i])),
+            max_el=float(found['max_el'][i]),
+            gs=observers[found['station'][i]]['name'],
+            norad=satellite['norad_cat_id'],
+        )
+        data.append(d)
+
+    if len(observers) == 1:
+        s += '.' * len(data)
+    else:
+        s += '%i passes' % len(data)
+    return data, s, prop
+
+
+def compute_passes_sgp4(args,
+                        steps_per_orbit=predict.STEPS_PER_ORBIT,
+                        tol=predict.TOL):
+    """Config obs and sat, Return pass data for all passes in given interval.
+    uses python-sgp4 with NumPy arrays
+
+    The whole interval is propagated at once, horizon crossings are found by
+    looking for sign changes in the sampled elevation, then all the rise, set,
+    and TCA times are refined together in batches.
+
+    `observer` may also be a list of station dicts.  The satellite is then
+    propagated once and its trajectory is evaluated against every station.
+
+    Arguments:
+    observer -- dict with 'name', 'lat', 'lon', 'altitude', 'min_horizon'
+    satellite -- dict with 'norad_cat_id' and 'tle' [line0,line1,line2]
+    start_time -- ephem.date string formatted 'yyyy/mm/dd hr:min:sec'
+    num_passes -- integer number of desired passes (defualt None)
+    duration -- float number of hours or fraction of hours (default None)
+
+    Specify either num_passes or duration.
+    If both, use min(num_passes, duration).
+    If neither, find passes for next 24 hours.
+
+    A satellite with a 'tles' list, see load_tle_history(), is propagated
+    with each of its TLEs in turn instead of only with 'tle'.
+
+    Elevation is sampled `steps_per_orbit` times per orbit and the crossings
+    are refined to `tol` seconds, use functools.partial() to change these for
+    compute_all_passes().
     """
-    passes_db = passes_db or config['DEFAULT']['passes_db']
+    data, s, _ = _compute_passes_vectorized(
+        args, predict.find_passes,
+        steps_per_orbit=steps_per_orbit, tol=tol)
+    print(s)
+    return data
 
-    conn = sqlite3.connect('file:' + passes_db, uri=True,
-                           detect_types=sqlite3.PARSE_DECLTYPES)
-    cur = conn.cursor()
-    cur.execute('''DROP TABLE IF EXISTS passes;''')
 
+def compute_passes_peaks(args,
+                         steps_per_orbit=predict.PEAK_STEPS_PER_ORBIT,
+                         tol=predict.TOL):
+    """Config obs and sat, Return pass data for all passes in given interval.
+    uses python-sgp4, searching from the elevation maxima (TCA first)
+
+    Elevation is sampled `steps_per_orbit` times per orbit to bracket each
+    local maximum, the maxima are refined to `tol` seconds, and only the
+    visible ones are searched for their rise and set.  This needs far fewer
+    propagator calls than stepping through the whole interval.  The number
+    of calls is printed along with the passes, use functools.partial() to
+    change the keyword arguments for compute_all_passes().
+
+    Arguments are the same as for compute_passes_sgp4().
+    """
+    data, s, prop = _compute_passes_vectorized(
+        args, predict.find_passes_peaks,
+        steps_per_orbit=steps_per_orbit, tol=tol)
+    s += ' %i calls' % prop.calls
+    if data:
+        s += ', %.1f calls/pass' % (prop.calls / len(data))
+    print(s)
+    return data
+
+
+def station_index(stations):
+    """Returns a predict.StationIndex of a list of station dicts, in the
+    same order.
+    """
+    return predict.StationIndex([gs['lat'] for gs in stations],
+                                [gs['lon'] for gs in stations],
+                                [gs['altitude'] for gs in stations],
+                                [gs['min_horizon'] for gs in stations])
+
+
+def who_can_see(stations, satellite, start_time, duration, index=None):
+    """Returns the passes of satellite over the stations which see it in
+    the `duration` hours from start_time.
+
+    Only the stations near the satellite's ground track, found with the
+    station_index() `index`, are searched for passes, so the stations need
+    not all be checked.  Pass the same index to repeated calls.
+    """
+    stations = list(stations)
+    if index is None:
+        index = station_index(stations)
+    start = ephem.date(start_time).datetime()
+    if satellite.get('tles'):
+        prop = predict.HistoryPropagator(
+            satellite['tles'], start, start + timedelta(hours=duration))
+    else:
+        prop = predict.Propagator(satellite['tle'], start)
+    found = index.candidates(prop, 0.0, duration * 3600.0)
+    if len(found) == 0:
+        return PassList()
+    # compute_passes_sgp4() without its progress line
+    data, _, _ = _compute_passes_vectorized(
+        ([stations[i] for i in found], satellite, start_time, None, duration),
+        predict.find_passes)
+    return data
+
+
+def _create_passes_tables(cur):
+    """Creates the passes table, its indexes, and the pass_inputs table which
+    records what each station--satellite pair was computed with.
+    """
     # column order needs to match PassTuple order
-    cur.execute('''CREATE TABLE passes
+    cur.execute('''CREATE TABLE IF NOT EXISTS passes
               (start timestamp,
               end timestamp,
               duration real,
@@ -855,38 +2109,833 @@ def compute_all_passes(stations, satellites, start_time,
               max_el real,
               gs text,
               norad integer);''')
-    cur.execute('''CREATE INDEX idx_gs ON passes (gs);''')
-    cur.execute('''CREATE INDEX idx_norad ON passes (norad);''')
-    cur.execute('''CREATE INDEX idx_gs_norad ON passes (gs, norad);''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS idx_gs ON passes (gs);''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS idx_norad ON passes (norad);''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS idx_gs_norad
+                   ON passes (gs, norad);''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS idx_start ON passes (start);''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS idx_gs_start
+                   ON passes (gs, start);''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS idx_norad_start
+                   ON passes (norad, start);''')
+    _create_passes_time_index(cur)
+
+    # column order needs to match _pass_inputs() plus the window
+    cur.execute('''CREATE TABLE IF NOT EXISTS pass_inputs
+              (gs text,
+              norad integer,
+              epoch timestamp,
+              min_horizon real,
+              lat real,
+              lon real,
+              altitude real,
+              start timestamp,
+              end timestamp,
+              PRIMARY KEY (gs, norad));''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS idx_inputs_norad
+                   ON pass_inputs (norad);''')
 
-    tree = IntervalTree()
 
-    jobargs = product(stations,
-                      satellites,
-                      (start_time,),  # single args are repeated
-                      (num_passes,),
-                      (duration,))
+# The passes_time R*Tree keeps 32-bit integer seconds from this time, good
+# until 2068.
+PASSES_TIME_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
 
-    if num_processes > 1:
-        with multiprocessing.Pool(num_processes) as pool:
-            result = pool.map(compute_function, jobargs)
+# seconds of a timestamp column from PASSES_TIME_EPOCH, rounded down
+_EPOCH_SECONDS = "(CAST(strftime('%s', {{}}) AS integer) - {:d})".format(
+    int(PASSES_TIME_EPOCH.timestamp()))
+
+
+def _passes_time_indexed(cur):
+    """Returns whether the passes_time index of a passes database is the
+    integer one which _passes_query() expects.
+    """
+    row = cur.execute('''SELECT sql FROM sqlite_master
+                         WHERE name = 'passes_time';''').fetchone()
+    return row is not None and 'rtree_i32' in row[0]
+
+
+def _create_passes_time_index(cur):
+    """Creates the passes_time R*Tree of the start and end second of every
+    pass, keyed by the passes rowid, and the triggers which keep it in step
+    with the passes table.  The passes of a database from before the index,
+    or with the older float index, are added to it.
+
+    The seconds count from PASSES_TIME_EPOCH and are exact integers, the end
+    is rounded up.  The index finds the passes within a second of a window,
+    the exact timestamps then narrow them.
+    """
+    exists = _passes_time_indexed(cur)
+    if not exists:
+        cur.execute('''DROP TABLE IF EXISTS passes_time;''')
+        for trigger in ('insert', 'update', 'delete'):
+            cur.execute('''DROP TRIGGER IF EXISTS passes_time_{};'''
+                        .format(trigger))
+    cur.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS passes_time
+                   USING rtree_i32(id, start_ts, end_ts);''')
+
+    start, end = (_EPOCH_SECONDS.format('new.start'),
+                  _EPOCH_SECONDS.format('new.end') + ' + 1')
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS passes_time_insert
+                   AFTER INSERT ON passes BEGIN
+                   INSERT INTO passes_time VALUES (new.rowid, {}, {});
+                   END;'''.format(start, end))
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS passes_time_update
+                   AFTER UPDATE OF start, end ON passes BEGIN
+                   UPDATE passes_time SET start_ts = {}, end_ts = {}
+                   WHERE id = new.rowid;
+                   END;'''.format(start, end))
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS passes_time_delete
+                   AFTER DELETE ON passes BEGIN
+                   DELETE FROM passes_time WHERE id = old.rowid;
+                   END;''')
+
+    if not exists:
+        cur.execute('''INSERT INTO passes_time
+                       SELECT rowid, {}, {} FROM passes;'''.format(
+                           _EPOCH_SECONDS.format('start'),
+                           _EPOCH_SECONDS.format('end') + ' + 1'))
+
+
+def _pass_inputs(observer, epoch):
+    """Returns the values which the passes of a pair depend on, other than the
+    time window, in pass_inputs column order.
+    """
+    return (epoch,
+            observer['min_horizon'],
+            observer['lat'],
+            observer['lon'],
+            observer['altitude'])
+
+
+def _tle_epochs(satellites):
+    """Returns a dict of NORAD number to naive UTC TLE epoch, the newest one
+    for satellites with a TLE history.
+    """
+    return {sat['norad_cat_id']:
+            TLE((sat.get('tles') or [sat['tle']])[-1])
+            .epoch.replace(tzinfo=None)
+            for sat in satellites}
+
+
+def _visible_stations(stations, satellites, start, end):
+    """Returns a boolean array for each satellite, False for the stations
+    which can never see it with any of its TLEs, see predict.may_see().
+    """
+    lat = [gs['lat'] for gs in stations]
+    lon = [gs['lon'] for gs in stations]
+    alt = [gs['altitude'] for gs in stations]
+    horizon = [gs['min_horizon'] for gs in stations]
+    visible = []
+    for sat in satellites:
+        see = False
+        for tle in sat.get('tles') or [sat['tle']]:
+            see = see | predict.may_see(TLE(tle), lat, lon, alt, horizon,
+                                        start, end)
+        visible.append(see)
+    return visible
+
+
+def _plan_incremental(cur, stations, satellites, visible, start, end):
+    """Compares the requested pairs and window with the pass_inputs table.
+
+    Pairs whose TLE epoch, horizon or location changed, or which are new, are
+    cleared and recomputed over [start, end].  Pairs which are unchanged and
+    were computed up to some time within [start, end] are only extended from
+    there.  Passes rising before `start` and pairs no longer requested are
+    removed.  Pairs which are not `visible` are recorded without a job.
+
+    Returns the plans of the satellites for _iter_jobs().  The pass_inputs
+    rows of the pairs without a job are written here, the others are written
+    as their jobs are handed out.
+    """
+    epochs = _tle_epochs(satellites)
+
+    # stations or satellites which are gone
+    names = {gs['name'] for gs in stations}
+    norads = {sat['norad_cat_id'] for sat in satellites}
+    for column, wanted in (('gs', names), ('norad', norads)):
+        rows = cur.execute('SELECT DISTINCT {} FROM pass_inputs;'
+                           .format(column)).fetchall()
+        for value, in rows:
+            if value not in wanted:
+                for table in ('passes', 'pass_inputs'):
+                    cur.execute('DELETE FROM {} WHERE {} = ?;'
+                                .format(table, column), (value,))
+
+    plans = []
+    for i, sat in enumerate(satellites):
+        norad = sat['norad_cat_id']
+        known = {row[0]: row[2:] for row in cur.execute(
+            'SELECT * FROM pass_inputs WHERE norad = ?;', (norad,))}
+
+        jobs = OrderedDict()  # job start -> station indices
+        records = []
+        for k, (gs, ok) in enumerate(zip(stations, visible[i])):
+            inputs = _pass_inputs(gs, epochs[norad])
+            old = known.get(gs['name'])
+            if (old is not None
+                    and tuple(old[:5]) == inputs
+                    and old[5] <= start <= old[6]):
+                # keep what is already computed and continue from its end
+                job_start = old[6]
+                cur.execute('''DELETE FROM passes
+                               WHERE gs = ? AND norad = ? AND start < ?;''',
+                            (gs['name'], norad, start))
+                if job_start < end:
+                    # passes found past the old end are found again
+                    cur.execute('''DELETE FROM passes
+                                   WHERE gs = ? AND norad = ? AND start >= ?;''',
+                                (gs['name'], norad, job_start))
+            else:
+                job_start = start
+                cur.execute('''DELETE FROM passes
+                               WHERE gs = ? AND norad = ?;''',
+                            (gs['name'], norad))
+            if ok and job_start < end:
+                jobs.setdefault(job_start, []).append(k)
+            else:
+                records.append((gs['name'], norad) + inputs
+                               + (start, max(end, job_start)))
+        cur.executemany('''INSERT OR REPLACE INTO pass_inputs
+                           VALUES (?,?,?,?,?,?,?,?,?);''', records)
+
+        plans.append([(job_start, (end - job_start).total_seconds() / 3600,
+                       np.array(k)) for job_start, k in jobs.items()])
+    return plans
+
+
+def _iter_jobs(plans, stations, satellites, num_passes, by_satellite):
+    """Yields the job args of compute_all_passes().
+
+    The plan of each satellite is a list of (job start, hours, station
+    indices), one job for all of the stations with by_satellite or one per
+    station.
+    """
+    for sat, plan in zip(satellites, plans):
+        for job_start, hours, indices in plan:
+            if by_satellite:
+                yield ([stations[k] for k in indices], sat, job_start,
+                       num_passes, hours)
+            else:
+                for k in indices:
+                    yield (stations[k], sat, job_start, num_passes, hours)
+
+
+def _shard_windows(job_start, hours, start, shard):
+    """Splits the window of a job at multiples of the `shard` timedelta from
+    `start`.
+
+    Each shard but the first starts SHARD_OVERLAP early, so passes in
+    progress at the boundary are not skipped.  Each shard but the last ends
+    SHARD_OVERLAP late and passes rising after that are dropped, the compute
+    functions follow a pass rising before the end of their window to its set
+    time.
+
+    Returns a list of (start, hours, until) of the shards.
+    """
+    job_start = ephem.date(job_start).datetime()
+    job_end = job_start + timedelta(hours=hours)
+
+    bounds = [job_start]
+    k = (job_start - start) // shard + 1
+    while start + k * shard < job_end:
+        bounds.append(start + k * shard)
+        k += 1
+    bounds.append(job_end)
+
+    windows = []
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        until = None
+        if a > job_start:
+            a -= SHARD_OVERLAP
+        if b < job_end:
+            b += SHARD_OVERLAP
+            until = b
+        windows.append((a, (b - a).total_seconds() / 3600, until))
+    return windows
+
+
+def _shard_jobs(jobargs, start, shard):
+    """Yields (args, until) tuples for _run_job() of the time shards of each
+    job, see _shard_windows().
+    """
+    for observers, satellite, job_start, num_passes, hours in jobargs:
+        for a, hours, until in _shard_windows(job_start, hours, start, shard):
+            yield (observers, satellite, a, num_passes, hours), until
+
+
+def _by_cost(jobs, cost, size=COST_BATCH):
+    """Yields the jobs ordered by `cost`, largest first, within consecutive
+    batches of `size` jobs.
+    """
+    jobs = iter(jobs)
+    while True:
+        batch = list(islice(jobs, size))
+        if not batch:
+            return
+        batch.sort(key=cost, reverse=True)
+        yield from batch
+
+
+def _job_stations(args):
+    """Returns the list of stations of a job, which has a single station or
+    a list of them.
+    """
+    observers = args[0]
+    return [observers] if isinstance(observers, Mapping) else observers
+
+
+def _job_cost(args, mean_motions):
+    """Relative run time of a job: stations times orbits in the window."""
+    _, satellite, _, _, hours = args
+    return (len(_job_stations(args))
+            * mean_motions[satellite['norad_cat_id']] * (hours or 24))
+
+
+def _cache_window(start, end):
+    """Returns [start, end] extended to multiples of CACHE_BUCKET."""
+    a = CACHE_EPOCH + (start - CACHE_EPOCH) // CACHE_BUCKET * CACHE_BUCKET
+    b = a - (a - end) // CACHE_BUCKET * CACHE_BUCKET
+    return a, b
+
+
+def _engine_name(compute_function):
+    """Returns the name of a compute function for the pass cache keys, the
+    same in every process and run.  The arguments of a functools.partial
+    are part of it.
+    """
+    func, args, keywords = compute_function, (), {}
+    while isinstance(func, partial):
+        args = func.args + args
+        keywords = dict(func.keywords, **keywords)
+        func = func.func
+    name = func.__module__ + '.' + func.__qualname__
+    if args or keywords:
+        name += json.dumps([args, sorted(keywords.items())], default=repr)
+    return name
+
+
+def _cached_job(cache, engine, job):
+    """Looks up the stations of an (args, until) job in the pass cache.
+
+    Returns the passes found, ready to be added, and the job for the
+    stations which are not in the cache, None if all are.  Its window is
+    extended with _cache_window() and the third item of the job tuple has
+    the requested window and the cache keys to store the results under.
+    Jobs without a fixed window are left alone.
+    """
+    args, until = job
+    observers, satellite, job_start, num_passes, hours = args
+    if num_passes is not None or hours is None:
+        return [], (args, until, None)
+
+    start = ephem.date(job_start).datetime()
+    end = start + timedelta(hours=hours)
+    a, b = _cache_window(start, end)
+    window = (start, end, {})
+
+    cached = []
+    missed = []
+    for gs in _job_stations(args):
+        key = cache.key(gs, satellite, engine, a, b)
+        found = cache.get(key)
+        if found is None:
+            window[2][gs['name']] = key
+            missed.append(gs)
+            continue
+        passes = [PassTuple(*p, gs=gs['name'],
+                            norad=satellite['norad_cat_id'])
+                  for p in found]
+        cached.extend(_job_passes((args, until, window), passes))
+
+    if not missed:
+        return cached, None
+    args = (missed[0] if isinstance(observers, Mapping) else missed,
+            satellite, a, None, (b - a).total_seconds() / 3600)
+    return cached, (args, until, window)
+
+
+def _job_passes(job, passes, cache=None):
+    """Returns the passes which belong to a job of compute_all_passes().
+
+    Passes rising at or after `until` belong to the next time shard.  Jobs
+    with a cache window computed more than was asked for, the passes of each
+    station are stored in the cache before they are trimmed.
+    """
+    args, until, window = job
+    if window is not None:
+        start, end, keys = window
+        if cache is not None and keys:
+            by_gs = {}
+            for p in passes:
+                by_gs.setdefault(p.gs, []).append(p)
+            for name, key in keys.items():
+                cache.put(key, by_gs.get(name, []))
+        passes = [p for p in passes if start <= p.start <= end]
+    if until is not None:
+        passes = [p for p in passes if p.start < until]
+    return passes
+
+
+# stations and satellites which the jobs of compute_all_passes() refer to
+_catalogs = None
+
+
+def _init_worker(stations, satellites):
+    """Pool initializer of compute_all_passes().
+
+    Each worker gets the station and satellite lists once, inherited when
+    the pool forks, so the jobs only need to carry indices into them.
+    """
+    global _catalogs
+    _catalogs = (stations, satellites)
+
+
+def _run_job(job):
+    """Runs one job of compute_all_passes() in a worker.
+
+    The job args refer to the stations and satellites of _init_worker() by
+    index, a tuple of indices for a list of stations.
+
+    Returns the job index, the passes, a dict of metrics about the job, and
+    the pstats of the job if `profile` is set.
+    """
+    i, compute_function, job_args, profile = job
+    gs, sat, start_time, num_passes, hours = job_args
+    stations, satellites = _catalogs
+    if isinstance(gs, int):
+        observers = stations[gs]
     else:
-        result = list(map(compute_function, jobargs))
+        observers = [stations[k] for k in gs]
+    args = (observers, satellites[sat], start_time, num_passes, hours)
 
-    print('Computed', len(result), 'Sat--GS pairs')
+    profiler = cProfile.Profile() if profile else None
 
-    for passdata in result:
+    t = time.perf_counter()
+    if profiler is None:
+        passes = compute_function(args)
+    else:
+        passes = profiler.runcall(compute_function, args)
+    wall = time.perf_counter() - t
+
+    observers, satellite, start_time, _, hours = args
+    single = isinstance(observers, Mapping)
+    metrics = {
+        'gs': observers['name'] if single else None,
+        'stations': 1 if single else len(observers),
+        'norad': satellite['norad_cat_id'],
+        'start': ephem.date(start_time).datetime(),
+        'hours': hours,
+        'wall': wall,
+        'passes': len(passes),
+        'calls': getattr(passes, 'calls', None),
+        'codes': getattr(passes, 'codes', ''),
+        'pid': os.getpid(),
+    }
+    stats = None if profiler is None else pstats.Stats(profiler).stats
+    return i, passes, metrics, stats
+
+
+class _ProfileStats:
+    """The stats of a job profile in a form pstats.Stats() will load."""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class _Monitor:
+    """Keeps track of the jobs done by compute_all_passes().
+
+    Writes the metrics of each job to the job_metrics table with `cur`, or
+    as JSON lines to `filename`.  Prints the throughput and an estimate of
+    the time left every `interval` seconds, and adds up the job profiles.
+    `total` is the cost of all of the jobs, as summed from _job_cost().
+    """
+    def __init__(self, total, cur=None, filename=None,
+                 interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.cur = cur
+        self.fp = open(filename, 'w') if filename else None
+        self.interval = interval
+        self.stats = None
+
+        self.jobs = 0
+        self.passes = 0
+        self.done = 0.0
+        self.t0 = self.last = time.perf_counter()
+
+        if cur is not None:
+            cur.execute('''CREATE TABLE IF NOT EXISTS job_metrics
+                      (gs text,
+                      stations integer,
+                      norad integer,
+                      start timestamp,
+                      hours real,
+                      wall real,
+                      passes integer,
+                      calls integer,
+                      codes text,
+                      pid integer);''')
+
+    def add(self, cost, metrics, stats, npasses):
+        self.jobs += 1
+        self.passes += npasses
+        self.done += cost
+
+        if self.cur is not None:
+            self.cur.execute('''INSERT INTO job_metrics
+                                VALUES (?,?,?,?,?,?,?,?,?,?);''',
+                             tuple(metrics.values()))
+        if self.fp is not None:
+            self.fp.write(json.dumps(metrics, default=str) + '\n')
+
+        if stats is not None:
+            if self.stats is None:
+                self.stats = pstats.Stats(_ProfileStats(stats))
+            else:
+                self.stats.add(_ProfileStats(stats))
+
+        now = time.perf_counter()
+        if self.interval and now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def skip(self, cost):
+        """Takes the cost of work which is not needed off the total."""
+        self.total -= cost
+
+    def report(self):
+        elapsed = time.perf_counter() - self.t0
+        left = self.total - self.done
+        if self.done:
+            eta = timedelta(seconds=round(elapsed * max(left, 0) / self.done))
+        else:
+            eta = 'unknown'
+        print('-- %i jobs, %i passes, %.1f jobs/s, %.0f passes/s, %.0f%% done,'
+              ' ETA %s'
+              % (self.jobs, self.passes, self.jobs / elapsed,
+                 self.passes / elapsed,
+                 100 * self.done / self.total if self.total else 100, eta),
+              flush=True)
+
+    def close(self, profile=None):
+        if self.jobs:
+            self.report()
+        if self.fp is not None:
+            self.fp.close()
+        if profile and self.stats is not None:
+            self.stats.dump_stats(profile)
+            self.stats.sort_stats('tottime').print_stats(PROFILE_LINES)
+
+
+def compute_all_passes(stations, satellites, start_time,
+                       passes_db=None,
+                       num_passes=None, duration=None,
+                       num_processes=4,
+                       compute_function=compute_passes_ephem,
+                       by_satellite=False,
+                       build_tree=True,
+                       chunksize=None,
+                       batch_size=BATCH_SIZE,
+                       incremental=False,
+                       prefilter=True,
+                       shard_hours=None,
+                       cache_db=None,
+                       cache_size=CACHE_SIZE,
+                       metrics=None,
+                       progress_interval=PROGRESS_INTERVAL,
+                       profile=None):
+    """Finds passes for all combinations of stations and satellites.
+
+    Saves the pass info as rows in an sqlite3 database and returns the data as
+    an IntervalTree with each data member set to the pass info as a namedtuple.
+
+    num_processes > 1 (default: 4) will use a parallel map() for computation.
+
+    by_satellite=True makes one job per satellite which is given the list of
+    all stations, so each satellite is propagated only once.  The
+    compute_function must accept a list of observers, as
+    compute_passes_sgp4() does.
+
+    Results are streamed from the workers as they finish and written to the
+    database in batches of `batch_size` rows.  Only a few `chunksize` chunks
+    of jobs are handed to the workers ahead of the results being written, so
+    memory stays flat however long the interval is.  With build_tree=False no
+    IntervalTree is kept and the number of passes is returned instead.
+
+    incremental=True updates an existing database instead of starting over
+    and needs a `duration`.  The TLE epoch, horizon, location and time window
+    used for each station--satellite pair are kept in the pass_inputs table.
+    Only pairs with changed inputs are recomputed, the others are extended
+    forward to the end of the new window, and the tree or count only has the
+    newly computed passes.
+
+    prefilter=True skips the pairs where the station is too far from the
+    ground track for any pass, judged from the TLE's inclination, mean motion
+    and eccentricity, and the drift of a geosynchronous satellite.
+
+    shard_hours splits the window of every job into time shards of this many
+    hours, so a year long window is spread evenly over the workers.  Passes
+    crossing a shard boundary are found whole by the shard they rise in.  In
+    any case the jobs are started with the largest first, within batches of
+    COST_BATCH jobs, so all workers stay busy until the end.
+
+    cache_db is the filename of a PassCache.  Station--satellite pairs with
+    the same TLE, station location and horizon, compute function, and a
+    window in the same CACHE_BUCKET as before are read from it, only the
+    others are computed.
+
+    metrics records the wall time, number of passes, propagator calls,
+    failure codes, and worker of every job, as JSON lines to the given
+    filename or, with metrics=True, in the job_metrics table of passes_db.
+    The throughput and time left are printed every `progress_interval`
+    seconds.  profile is a filename to save the pstats of all jobs to,
+    profiled in the workers and added up.
+    """
+    passes_db = passes_db or config['DEFAULT']['passes_db']
+
+    if incremental and duration is None:
+        raise ValueError('incremental updates need a duration')
+
+    conn = sqlite3.connect('file:' + passes_db, uri=True,
+                           detect_types=sqlite3.PARSE_DECLTYPES)
+    cur = conn.cursor()
+    if not incremental:
+        cur.execute('''DROP TABLE IF EXISTS passes;''')
+        cur.execute('''DROP TABLE IF EXISTS passes_time;''')
+        cur.execute('''DROP TABLE IF EXISTS pass_inputs;''')
+        cur.execute('''DROP TABLE IF EXISTS job_metrics;''')
+    _create_passes_tables(cur)
+
+    tree = IntervalTree() if build_tree else None
+
+    stations = list(stations)
+    satellites = list(satellites)
+
+    start = ephem.date(start_time).datetime()
+    end = None
+    if duration is not None:
+        end = start + timedelta(hours=duration)
+
+    if prefilter:
+        visible = _visible_stations(stations, satellites, start, end)
+        nskipped = sum(len(stations) - sum(v) for v in visible)
+        print('Skipped %i of %i Sat--GS pairs which can not have passes'
+              % (nskipped, len(stations) * len(satellites)))
+    else:
+        visible = [[True] * len(stations)] * len(satellites)
+
+    epochs = _tle_epochs(satellites)
+    # the window is known, so a later incremental run can use it
+    recording = duration is not None and num_passes is None
+    if incremental:
+        plans = _plan_incremental(cur, stations, satellites, visible,
+                                  start, end)
+    else:
+        plans = [[(start_time, duration, np.flatnonzero(v))] if any(v)
+                 else [] for v in visible]
+        if recording:
+            for sat, v in zip(satellites, visible):
+                norad = sat['norad_cat_id']
+                cur.executemany('''INSERT OR REPLACE INTO pass_inputs
+                                   VALUES (?,?,?,?,?,?,?,?,?);''',
+                                [(gs['name'], norad)
+                                 + _pass_inputs(gs, epochs[norad])
+                                 + (start, end)
+                                 for gs, ok in zip(stations, v) if not ok])
+    jobs = _iter_jobs(plans, stations, satellites, num_passes, by_satellite)
+
+    shard = None
+    if shard_hours and duration is not None and num_passes is None:
+        shard = timedelta(hours=shard_hours)
+        jobs = _shard_jobs(jobs, start, shard)
+    else:
+        jobs = ((args, None) for args in jobs)
+
+    # the number and cost of the jobs, for the chunk size and progress
+    mean_motions = {sat['norad_cat_id']: TLE(sat['tle']).mean_motion
+                    for sat in satellites}
+    njobs = total = 0
+    for sat, plan in zip(satellites, plans):
+        for job_start, hours, indices in plan:
+            if shard is None:
+                windows = [(job_start, hours, None)]
+            else:
+                windows = _shard_windows(job_start, hours, start, shard)
+            njobs += len(windows) * (1 if by_satellite else len(indices))
+            total += (len(indices) * mean_motions[sat['norad_cat_id']]
+                      * sum(hours or 24 for _, hours, _ in windows))
+    if shard is not None:
+        print('Split the jobs into', njobs, 'time shards')
+
+    def recorded(jobs):
+        # the pass_inputs rows of the pairs are written along with the
+        # passes, once for the last shard of each job
+        for args, until in jobs:
+            if recording and until is None:
+                norad = args[1]['norad_cat_id']
+                records.extend(
+                    (gs['name'], norad) + _pass_inputs(gs, epochs[norad])
+                    + (start, end)
+                    for gs in _job_stations(args))
+            yield args, until
+
+    rows = []
+    records = []
+    jobs = recorded(jobs)
+
+    cache = None
+    engine = None
+    if cache_db is not None:
+        cache = PassCache(cache_db, cache_size)
+        engine = _engine_name(compute_function)
+
+    jobs = _by_cost(jobs, lambda job: _job_cost(job[0], mean_motions))
+    # jobs refer to the stations and satellites by index
+    station_index = {id(gs): k for k, gs in enumerate(stations)}
+    satellite_index = {id(sat): k for k, sat in enumerate(satellites)}
+
+    def indices(args):
+        observers, sat, job_start, num_passes, hours = args
+        if isinstance(observers, Mapping):
+            gs = station_index[id(observers)]
+        else:
+            gs = tuple(station_index[id(o)] for o in observers)
+        return (gs, satellite_index[id(sat)], job_start, num_passes, hours)
+
+    monitor = _Monitor(total,
+                       cur=cur if metrics is True else None,
+                       filename=None if metrics is True else metrics,
+                       interval=progress_interval)
+
+    # (gs, norad, boundary) of the passes rising next to a shard boundary
+    boundary_passes = set()
+
+    npasses = 0
+
+    def write(rows):
+        cur.executemany('INSERT INTO passes VALUES (?,?,?,?,?,?,?,?,?);', rows)
+        cur.executemany('''INSERT OR REPLACE INTO pass_inputs
+                           VALUES (?,?,?,?,?,?,?,?,?);''', records)
+        rows.clear()
+        records.clear()
+
+    def add(passdata):
+        """Adds passes to the tree and database, returns how many."""
+        nonlocal npasses
+        n = npasses
         for d in passdata:
-            try:
-                tree.addi(d.start, d.end, d)
-                cur.execute(
-                        'INSERT INTO passes VALUES (?,?,?,?,?,?,?,?,?);', d)
-            except ValueError:
+            if not d.start < d.end:
                 print('!!! Invalid pass !!!')
                 print(d.start)
                 print(d.end)
                 print(d)
+                continue
+            if shard is not None:
+                k = round((d.start - start) / shard)
+                boundary = start + k * shard
+                if abs(d.start - boundary) < SHARD_OVERLAP:
+                    # found by the shards on both sides
+                    if (d.gs, d.norad, k) in boundary_passes:
+                        continue
+                    boundary_passes.add((d.gs, d.norad, k))
+            if tree is not None:
+                tree.addi(d.start, d.end, d)
+            rows.append(d)
+            npasses += 1
+        if len(rows) >= batch_size or len(records) >= batch_size:
+            write(rows)
+        return npasses - n
+
+    if num_processes > 1:
+        if chunksize is None:
+            # small chunks keep every worker busy until the end
+            chunksize = max(1, min(MAX_CHUNKSIZE,
+                                   njobs // (16 * num_processes)))
+        max_running = 4 * num_processes * chunksize
+    else:
+        max_running = 1
+
+    # The jobs are handed to the pool through a queue, only a few chunks
+    # ahead of the results, and None ends them.
+    tasks = queue.Queue()
+    running = {}  # task index -> job, cost
+    ntasks = 0
+    more = True
+
+    def feed():
+        """Queues jobs up to max_running, returns whether any are running."""
+        nonlocal more, ntasks
+        while more and len(running) < max_running:
+            job = next(jobs, None)
+            if job is None:
+                more = False
+                tasks.put(None)
+                break
+            args = job[0]
+            cost = _job_cost(args, mean_motions)
+            if cache is None:
+                job = job + (None,)
+            else:
+                # the passes of the stations in the cache are added now
+                found, job = _cached_job(cache, engine, job)
+                add(found)
+                if job is None:
+                    monitor.skip(cost)
+                    continue
+                # only the stations not in the cache are left to compute
+                share = len(_job_stations(job[0])) / len(_job_stations(args))
+                monitor.skip(cost * (1 - share))
+                cost *= share
+            running[ntasks] = job, cost
+            tasks.put((ntasks, compute_function, indices(job[0]),
+                       bool(profile)))
+            ntasks += 1
+        return bool(running)
+
+    if num_processes > 1:
+        pool = multiprocessing.Pool(num_processes, _init_worker,
+                                    (stations, satellites))
+        results = pool.imap_unordered(_run_job, iter(tasks.get, None),
+                                      chunksize)
+    else:
+        pool = nullcontext()
+        _init_worker(stations, satellites)
+        results = map(_run_job, iter(tasks.get, None))
+
+    with pool:
+        try:
+            while feed():
+                i, passdata, job_metrics, stats = next(results)
+                job, cost = running.pop(i)
+                passdata = _job_passes(job, passdata, cache)
+                # the passes written, without those outside of the job's
+                # window or already found by the neighboring shard
+                job_metrics['passes'] = add(passdata)
+                monitor.add(cost, job_metrics, stats, job_metrics['passes'])
+        finally:
+            if more:
+                # never leave the pool's task feeder waiting for a job
+                tasks.put(None)
+            _init_worker(None, None)
+
+    njobs = monitor.jobs
+    if cache is not None:
+        print('Found', cache.hits, 'of', cache.hits + cache.misses,
+              'Sat--GS pairs in the cache')
+    if by_satellite:
+        print('Computed', njobs, 'Sat--all GS jobs')
+    else:
+        print('Computed', njobs, 'Sat--GS pairs')
+
+    monitor.close(profile)
+
+    write(rows)
     conn.commit()
     conn.close()
-    print('%i passes' % len(tree))
-    return tree
+    if cache is not None:
+        cache.close()
+    print('%i passes' % npasses)
+    return tree if build_tree else npasses
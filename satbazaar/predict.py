@@ -0,0 +1,1088 @@
+"""predict` -- Vectorized satellite pass prediction
+==================================================
+
+Propagate a TLE over a whole time window with the array interface of
+`python-sgp4` and find the intervals where the satellite is above a ground
+station's horizon.
+
+Times inside this module are float seconds relative to the start of the
+search window.  The start itself is kept as a Julian date pair (jd, fr) so
+the propagator always sees the full precision.
+
+Angles given to and returned from the public functions are in degrees,
+distances in kilometers, except for station altitude which is in meters to
+match the station JSON files.
+"""
+from datetime import timezone
+from math import ceil
+
+import numpy as np
+from sgp4.api import Satrec, jday
+
+
+# WGS-84 ellipsoid for the ground stations
+EARTH_RADIUS = 6378.137  # km
+EARTH_FLATTENING = 1.0 / 298.257223563
+EARTH_ROTATION = 7.292115146706979e-5  # rad/s
+
+SECONDS_PER_DAY = 86400.0
+
+# Sample the elevation this many times per orbit to look for horizon
+# crossings.  libastro uses 180, the check for low peaks between samples
+# (PEAK_MARGIN) finds the short passes a coarser grid would otherwise miss.
+STEPS_PER_ORBIT = 30
+
+# Rise, set, and TCA times are refined to this many seconds.  libastro
+# declares convergence at the same value.
+TOL = 0.01
+
+# Sampled elevation maxima within this many degrees below the horizon are
+# checked for a short pass hiding between two samples.
+PEAK_MARGIN = 5.0
+
+# find_peaks() only needs to bracket each elevation maximum
+PEAK_STEPS_PER_ORBIT = 6
+
+# Bound on the number of (station, time) elevation samples held at once.
+CHUNK_SIZE = 2**20
+
+# Without a duration, search as far ahead as compute_passes_ephem() does.
+MAX_SEARCH = 5 * 365 * SECONDS_PER_DAY
+
+# limit on root finder iterations, typically 4 to 8 are needed
+MAXITER = 40
+
+# The switch from one TLE to the next is looked for at most this far before
+# the epoch of the next one, see switch_time().
+MAX_SWITCH_SEARCH = 3 * SECONDS_PER_DAY
+
+# StationIndex buckets stations in cells of this many degrees of latitude and
+# longitude
+INDEX_CELL = 10.0
+
+# Earth gravitational parameter of WGS-72, as used by SGP4
+EARTH_MU = 398600.8  # km^3/s^2
+
+# may_see() works from mean elements and geocentric geometry, it only rules
+# out stations which miss the satellite by more than this many degrees.
+VISIBILITY_MARGIN = 1.0
+
+# Orbits within this many revolutions per day of the Earth's rotation, and
+# nearly circular and equatorial, are treated as geosynchronous by may_see().
+SIDEREAL_REVS = 1.00273790935
+GEO_REVS = 0.1
+GEO_ECCENTRICITY = 0.05
+GEO_INCLINATION = 15.0
+
+# Uncertainty of the longitude drift predicted from the mean motion, in
+# degrees per day away from the TLE epoch.
+GEO_DRIFT_ERROR = 0.02
+
+
+def julian_date(dt):
+    """Return the (jd, fr) pair for a datetime, naive datetimes are UTC."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return jday(dt.year, dt.month, dt.day,
+                dt.hour, dt.minute, dt.second + dt.microsecond * 1e-6)
+
+
+def gmst(jd, fr):
+    """Greenwich mean sidereal time in radians (IAU-82, as used by SGP4)."""
+    tut1 = ((jd - 2451545.0) + fr) / 36525.0
+    theta = (-6.2e-6 * tut1**3
+             + 0.093104 * tut1**2
+             + (876600.0 * 3600.0 + 8640184.812866) * tut1
+             + 67310.54841)
+    # seconds of time -> radians
+    return np.remainder(np.radians(theta / 240.0), 2.0 * np.pi)
+
+
+def station_frames(lat, lon, alt):
+    """Return Earth-fixed positions and East-North-Up rotations of stations.
+
+    Arguments:
+    lat, lon -- geodetic latitude and longitude in degrees, scalars or arrays
+    alt -- height above the ellipsoid in meters
+
+    Returns (pos, rot) with shapes (M, 3) and (M, 3, 3).  The rows of each
+    rotation matrix are the local east, north, and up unit vectors.
+    """
+    lat = np.radians(np.atleast_1d(np.asarray(lat, dtype=float)))
+    lon = np.radians(np.atleast_1d(np.asarray(lon, dtype=float)))
+    alt = np.atleast_1d(np.asarray(alt, dtype=float)) / 1000.0
+
+    e2 = EARTH_FLATTENING * (2.0 - EARTH_FLATTENING)
+    slat, clat = np.sin(lat), np.cos(lat)
+    slon, clon = np.sin(lon), np.cos(lon)
+    n = EARTH_RADIUS / np.sqrt(1.0 - e2 * slat**2)
+
+    pos = np.stack(((n + alt) * clat * clon,
+                    (n + alt) * clat * slon,
+                    (n * (1.0 - e2) + alt) * slat), axis=-1)
+
+    zero = np.zeros_like(lat)
+    rot = np.stack((np.stack((-slon, clon, zero), axis=-1),
+                    np.stack((-slat * clon, -slat * slon, clat), axis=-1),
+                    np.stack((clat * clon, clat * slon, slat), axis=-1)),
+                   axis=-2)
+    return pos, rot
+
+
+def look_angles(pos, station_pos, station_rot):
+    """Azimuth and elevation in degrees of Earth-fixed positions.
+
+    Shapes broadcast: pos (..., 3), station_pos (..., 3), station_rot
+    (..., 3, 3).
+    """
+    rho = pos - station_pos
+    enu = np.einsum('...ij,...j->...i', station_rot, rho)
+    east, north, up = enu[..., 0], enu[..., 1], enu[..., 2]
+    az = np.degrees(np.arctan2(east, north)) % 360.0
+    el = np.degrees(np.arctan2(up, np.hypot(east, north)))
+    return az, el
+
+
+def elevation(pos, station_pos, station_rot):
+    """Elevation in degrees, see look_angles()."""
+    rho = pos - station_pos
+    up = np.einsum('...j,...j->...', station_rot[..., 2, :], rho)
+    return np.degrees(np.arcsin(up / np.linalg.norm(rho, axis=-1)))
+
+
+def elevation_rate(pos, vel, station_pos, station_rot):
+    """Rate of change of sin(elevation) in 1/s, zero at the TCA.
+
+    vel is the Earth-fixed velocity in km/s, other arguments as for
+    look_angles().
+    """
+    rho = pos - station_pos
+    zenith = station_rot[..., 2, :]
+    up = np.einsum('...j,...j->...', zenith, rho)
+    up_rate = np.einsum('...j,...j->...', zenith, vel)
+    dist = np.linalg.norm(rho, axis=-1)
+    dist_rate = np.einsum('...j,...j->...', rho, vel) / dist
+    return (up_rate * dist - up * dist_rate) / dist**2
+
+
+def may_see(tle, lat, lon, alt, horizon, start=None, end=None,
+             margin=VISIBILITY_MARGIN):
+    """Find which stations could ever see a satellite, from its TLE alone.
+
+    A station is ruled out when it is farther from the satellite's ground
+    track than the footprint of the satellite at apogee: when it is too far
+    north or south for the inclination, or for a geosynchronous satellite
+    when the longitudes the satellite drifts over in [start, end] are too far
+    away.  The longitude check needs start and end, naive datetimes are UTC.
+
+    Arguments:
+    tle -- object with the mean elements in degrees and revolutions per day
+           and the epoch, as satbazaar.db.TLE
+    lat, lon, alt, horizon -- station locations and minimum elevations as for
+                              station_frames() and find_passes()
+
+    Returns a boolean array, False where no pass is possible.
+    """
+    pos, _ = station_frames(lat, lon, alt)
+    radius = np.linalg.norm(pos, axis=-1)
+    geocentric_lat = np.arcsin(pos[:, 2] / radius)
+    h = np.radians(np.broadcast_to(np.asarray(horizon, dtype=float),
+                                   radius.shape))
+
+    n = tle.mean_motion * 2.0 * np.pi / SECONDS_PER_DAY
+    apogee = (EARTH_MU / n**2)**(1.0 / 3.0) * (1.0 + tle.eccentricity)
+
+    # Earth central angle from the station to the edge of its view of a
+    # satellite at apogee height
+    reach = np.arccos(np.clip(radius * np.cos(h) / apogee, -1.0, 1.0)) - h
+
+    # the ground track stays within this angle of the reference points
+    max_lat = np.radians(min(tle.inclination, 180.0 - tle.inclination))
+    offset = max_lat
+    dlon = np.zeros_like(radius)
+
+    if (start is not None and end is not None
+            and abs(tle.mean_motion - SIDEREAL_REVS) < GEO_REVS
+            and tle.eccentricity < GEO_ECCENTRICITY
+            and np.degrees(max_lat) < GEO_INCLINATION):
+        epoch = tle.epoch
+        if epoch.tzinfo is not None:
+            epoch = epoch.astimezone(timezone.utc).replace(tzinfo=None)
+        t0 = (start - epoch).total_seconds() / SECONDS_PER_DAY
+        t1 = (end - epoch).total_seconds() / SECONDS_PER_DAY
+
+        # mean longitude over the Greenwich meridian at the epoch, drifting
+        # at the difference of mean motion and Earth rotation
+        lon0 = (tle.raan + tle.ap + tle.mean_anomaly
+                - np.degrees(gmst(*julian_date(epoch))))
+        drift = (tle.mean_motion - SIDEREAL_REVS) * 360.0
+        west, east = sorted((lon0 + drift * t0, lon0 + drift * t1))
+        error = GEO_DRIFT_ERROR * max(abs(t0), abs(t1))
+
+        if east - west + 2.0 * error < 360.0:
+            # angle from each station to the nearest end of the longitudes
+            mid = (west + east) / 2.0
+            half = (east - west) / 2.0 + error
+            away = np.abs((np.asarray(lon) - mid + 180.0) % 360.0 - 180.0)
+            dlon = np.radians(np.maximum(away - half, 0.0))
+            # the satellite wanders about the mean longitude with the
+            # eccentricity and inclination
+            offset = (max_lat + 2.0 * tle.eccentricity
+                      + max_lat**2 / 4.0)
+
+    distance = np.arccos(np.cos(geocentric_lat) * np.cos(dlon))
+    return distance - offset <= reach + np.radians(margin)
+
+
+class StationIndex:
+    """Spatial index of ground stations for footprint queries.
+
+    Stations are kept as Earth-fixed unit vectors, bucketed by geocentric
+    latitude and longitude in cells of `cell` degrees.  A query around a
+    sub-satellite point only looks at the stations in the cells which
+    overlap it, then checks them exactly.
+    """
+    def __init__(self, lat, lon, alt, horizon=0.0, cell=INDEX_CELL):
+        """
+        lat, lon, alt, horizon -- station locations and minimum elevations
+                                  as for station_frames() and find_passes()
+        """
+        self.pos, self.rot = station_frames(lat, lon, alt)
+        n = len(self.pos)
+        self.horizon = np.broadcast_to(np.asarray(horizon, dtype=float),
+                                       (n,)).copy()
+        self.radius = np.linalg.norm(self.pos, axis=-1)
+        self.unit = self.pos / self.radius[:, np.newaxis]
+
+        self.cell = cell
+        self.nlat = ceil(180.0 / cell)
+        self.nlon = ceil(360.0 / cell)
+        glat = np.degrees(np.arcsin(self.unit[:, 2]))
+        glon = np.degrees(np.arctan2(self.unit[:, 1], self.unit[:, 0]))
+        i = np.minimum(((glat + 90.0) // cell).astype(int), self.nlat - 1)
+        j = ((glon + 180.0) // cell).astype(int) % self.nlon
+        key = i * self.nlon + j
+        # stations of cell k are order[starts[k]:starts[k + 1]]
+        self.order = np.argsort(key, kind='stable')
+        self.starts = np.searchsorted(key[self.order],
+                                      np.arange(self.nlat * self.nlon + 1))
+
+    def __len__(self):
+        return len(self.pos)
+
+    def _cells(self, lat, lon, angle):
+        """Returns the cells overlapping the circle of `angle` degrees around
+        the geocentric point (lat, lon).
+        """
+        lat0, lat1 = max(lat - angle, -90.0), min(lat + angle, 90.0)
+        rows = np.arange(int((lat0 + 90.0) // self.cell),
+                         min(int((lat1 + 90.0) // self.cell), self.nlat - 1)
+                         + 1)
+
+        # widest longitude of a circle which does not contain a pole
+        s = np.sin(np.radians(angle))
+        c = np.cos(np.radians(lat))
+        if lat1 >= 90.0 or lat0 <= -90.0 or s >= c:
+            cols = np.arange(self.nlon)
+        else:
+            width = np.degrees(np.arcsin(s / c))
+            j0 = int((lon - width + 180.0) // self.cell)
+            j1 = int((lon + width + 180.0) // self.cell)
+            cols = np.arange(j0, min(j1, j0 + self.nlon - 1) + 1) % self.nlon
+        return (rows[:, np.newaxis] * self.nlon + cols).ravel()
+
+    def near(self, lat, lon, angle):
+        """Returns the indices of the stations within `angle` degrees of
+        Earth central angle from the geocentric point (lat, lon).
+        """
+        cells = self._cells(lat, lon, angle)
+        found = [self.order[self.starts[k]:self.starts[k + 1]] for k in cells]
+        found = np.concatenate(found) if found else np.zeros(0, dtype=int)
+        u = np.array([np.cos(np.radians(lat)) * np.cos(np.radians(lon)),
+                      np.cos(np.radians(lat)) * np.sin(np.radians(lon)),
+                      np.sin(np.radians(lat))])
+        keep = self.unit[found] @ u >= np.cos(np.radians(angle))
+        return np.sort(found[keep])
+
+    def footprint(self, pos):
+        """Returns the Earth central angle in degrees from the sub-point of a
+        satellite at Earth-fixed `pos` to the farthest station which could
+        see it, the one with the lowest horizon.
+        """
+        h = np.radians(self.horizon.min()) if len(self) else 0.0
+        r = np.linalg.norm(pos, axis=-1)
+        reach = np.arccos(np.clip(EARTH_RADIUS * np.cos(h) / r, -1.0, 1.0)) - h
+        return np.degrees(reach)
+
+    def visible(self, pos):
+        """Returns the indices of the stations which have a satellite at
+        Earth-fixed `pos` above their horizon.
+        """
+        pos = np.asarray(pos, dtype=float)
+        r = np.linalg.norm(pos)
+        lat = np.degrees(np.arcsin(pos[2] / r))
+        lon = np.degrees(np.arctan2(pos[1], pos[0]))
+        # stations above sea level see a little farther
+        near = self.near(lat, lon, self.footprint(pos) + VISIBILITY_MARGIN)
+        el = elevation(pos, self.pos[near], self.rot[near])
+        return near[el >= self.horizon[near]]
+
+    def candidates(self, prop, t0, t1, steps_per_orbit=STEPS_PER_ORBIT):
+        """Returns the indices of the stations which may see the satellite of
+        `prop` between t0 and t1 seconds.
+
+        The sub-point is sampled `steps_per_orbit` times per orbit.  A
+        station is a candidate when it is within the footprint, widened by
+        half the angle between samples, of a sample.
+        """
+        step = prop.period / steps_per_orbit
+        t = np.linspace(t0, t1, max(2, ceil((t1 - t0) / step) + 1))
+        pos = prop.ecef(t)
+        ok = np.isfinite(pos).all(axis=-1)
+        pos = pos[ok]
+        if len(pos) == 0 or len(self) == 0:
+            return np.zeros(0, dtype=int)
+
+        unit = pos / np.linalg.norm(pos, axis=-1)[:, np.newaxis]
+        gap = np.arccos(np.clip((unit[1:] * unit[:-1]).sum(axis=-1),
+                                -1.0, 1.0))
+        margin = np.degrees(gap.max()) / 2.0 if len(gap) else 0.0
+        angle = self.footprint(pos).max() + margin + VISIBILITY_MARGIN
+
+        lat = np.degrees(np.arcsin(unit[:, 2]))
+        lon = np.degrees(np.arctan2(unit[:, 1], unit[:, 0]))
+        seen = np.zeros(len(self), dtype=bool)
+        for a, b in zip(lat, lon):
+            seen[self.near(a, b, angle)] = True
+        return np.nonzero(seen)[0]
+
+
+class Propagator:
+    """Earth-fixed position of a satellite from its TLE.
+
+    Positions are requested at times in seconds relative to `start`.  The
+    number of propagated time points is kept in `calls`, and the number of
+    those which failed (e.g. decayed orbits) in `errors`.
+    """
+    def __init__(self, tle, start):
+        """
+        tle: 3 element list containing [line0, line1, line2]
+        start: datetime of the start of the window, naive datetimes are UTC
+        """
+        self.tle = tuple(tle)
+        self.satrec = Satrec.twoline2rv(self.tle[1], self.tle[2])
+        self.start = start
+        self.jd, self.fr = julian_date(start)
+        self.calls = 0
+        self.errors = 0
+
+    @property
+    def period(self):
+        """Orbital period in seconds."""
+        return 2.0 * np.pi / self.satrec.no_kozai * 60.0
+
+    @property
+    def perigee_period(self):
+        """Period in seconds of a circular orbit as fast as this one at
+        perigee.  Sampled by it, an eccentric orbit is sampled as finely near
+        perigee as a circular one is by its period.
+        """
+        e = self.satrec.ecco
+        return self.period * (1.0 - e * e)**1.5 / (1.0 + e)**2
+
+    def ecef(self, t, velocity=False):
+        """Return Earth-fixed positions (km) at times `t`, shape t.shape + (3,).
+
+        With `velocity`, return a (position, velocity in km/s) pair instead.
+        Values which the propagator could not compute are NaN.
+        """
+        t = np.asarray(t, dtype=float)
+        shape = t.shape + (3,)
+        fr = self.fr + t.ravel() / SECONDS_PER_DAY
+        jd = np.full_like(fr, self.jd)
+        e, r, v = self.satrec.sgp4_array(jd, fr)
+        self.calls += fr.size
+
+        # TEME -> pseudo Earth-fixed, ignoring polar motion
+        theta = gmst(jd, fr)
+        c, s = np.cos(theta), np.sin(theta)
+        pos = np.empty_like(r)
+        pos[:, 0] = c * r[:, 0] + s * r[:, 1]
+        pos[:, 1] = -s * r[:, 0] + c * r[:, 1]
+        pos[:, 2] = r[:, 2]
+
+        failed = e != 0
+        if failed.any():
+            self.errors += int(failed.sum())
+            pos[failed] = np.nan
+
+        if not velocity:
+            return pos.reshape(shape)
+
+        # the Earth-fixed frame rotates under the satellite
+        vel = np.empty_like(v)
+        vel[:, 0] = c * v[:, 0] + s * v[:, 1] + EARTH_ROTATION * pos[:, 1]
+        vel[:, 1] = -s * v[:, 0] + c * v[:, 1] - EARTH_ROTATION * pos[:, 0]
+        vel[:, 2] = v[:, 2]
+        return pos.reshape(shape), vel.reshape(shape)
+
+
+def switch_time(prop0, prop1, t0, t1, steps_per_orbit=STEPS_PER_ORBIT,
+                tol=TOL):
+    """Time between t0 and t1 where two propagators agree most closely.
+
+    The distance between the positions is sampled `steps_per_orbit` times
+    per orbit and its smallest sample refined by golden section search to
+    `tol` seconds.  Both propagators must share the same start.
+    """
+    if t1 <= t0:
+        return t1
+
+    def distance(t):
+        return np.linalg.norm(prop0.ecef(t) - prop1.ecef(t), axis=-1)
+
+    step = min(prop0.period, prop1.period) / steps_per_orbit
+    t = np.linspace(t0, t1, max(2, ceil((t1 - t0) / step) + 1))
+    d = distance(t)
+    if np.isnan(d).all():
+        return t1
+    i = int(np.nanargmin(d))
+    a, b = t[max(i - 1, 0)], t[min(i + 1, len(t) - 1)]
+
+    ratio = (np.sqrt(5.0) - 1.0) / 2.0
+    c, e = b - ratio * (b - a), a + ratio * (b - a)
+    dc, de = distance(np.array([c, e]))
+    while b - a > tol:
+        if dc <= de:
+            b, e, de = e, c, dc
+            c = b - ratio * (b - a)
+            dc = distance(np.array([c]))[0]
+        else:
+            a, c, dc = c, e, de
+            e = a + ratio * (b - a)
+            de = distance(np.array([e]))[0]
+    return (a + b) / 2.0
+
+
+class HistoryPropagator:
+    """Earth-fixed position of a satellite from a series of its TLEs.
+
+    Each TLE is used from the time where its positions agree most closely
+    with those of the previous TLE, see switch_time(), until the switch to
+    the next one.  The propagator has the same interface as Propagator, so
+    a window spanning several TLE updates is searched in one go.
+
+    TLEs which were superseded before `start`, and those with epochs after
+    `end`, are not used.  TLEs with the same epoch keep the last one given.
+    """
+    def __init__(self, tles, start, end=None,
+                 steps_per_orbit=STEPS_PER_ORBIT, tol=TOL):
+        """
+        tles: list of 3 element lists containing [line0, line1, line2]
+        start: datetime of the start of the window, naive datetimes are UTC
+        end: datetime of the end of the window, or None for no end
+        """
+        self.start = start
+        self.jd, self.fr = julian_date(start)
+
+        by_epoch = {}
+        for tle in tles:
+            prop = Propagator(tle, start)
+            epoch = ((prop.satrec.jdsatepoch - self.jd)
+                     + (prop.satrec.jdsatepochF - self.fr)) * SECONDS_PER_DAY
+            by_epoch[epoch] = prop
+        if not by_epoch:
+            raise ValueError('no TLEs given')
+        epochs = sorted(by_epoch)
+
+        t_end = np.inf
+        if end is not None:
+            t_end = (end - start).total_seconds()
+        first = max([0] + [i for i, e in enumerate(epochs) if e <= 0.0])
+        epochs = [e for e in epochs[first:] if e < t_end] or epochs[first:1]
+
+        self.props = [by_epoch[e] for e in epochs]
+        self.epochs = np.array(epochs)
+        self.tle = self.props[-1].tle
+
+        # switch times in seconds, props[k] is used from switches[k - 1] on
+        switches = []
+        for k in range(1, len(self.props)):
+            # not clipped to the window, so time shards of a longer window
+            # switch at the same times
+            t0 = max(epochs[k - 1], epochs[k] - MAX_SWITCH_SEARCH,
+                     switches[-1] if switches else -np.inf)
+            switches.append(switch_time(self.props[k - 1], self.props[k],
+                                        t0, epochs[k],
+                                        steps_per_orbit, tol))
+        self.switches = np.array(switches)
+
+    @property
+    def calls(self):
+        return sum(prop.calls for prop in self.props)
+
+    @property
+    def errors(self):
+        return sum(prop.errors for prop in self.props)
+
+    @property
+    def period(self):
+        """Shortest orbital period of the TLEs in seconds."""
+        return min(prop.period for prop in self.props)
+
+    @property
+    def perigee_period(self):
+        """Shortest Propagator.perigee_period of the TLEs in seconds."""
+        return min(prop.perigee_period for prop in self.props)
+
+    def ecef(self, t, velocity=False):
+        """Return Earth-fixed positions (km) at times `t`, shape t.shape + (3,).
+
+        See Propagator.ecef().
+        """
+        t = np.asarray(t, dtype=float)
+        if len(self.props) == 1:
+            return self.props[0].ecef(t, velocity)
+
+        flat = t.ravel()
+        which = np.searchsorted(self.switches, flat, side='right')
+        pos = np.empty(flat.shape + (3,))
+        vel = np.empty_like(pos)
+        for k in np.unique(which):
+            sel = which == k
+            if velocity:
+                pos[sel], vel[sel] = self.props[k].ecef(flat[sel], True)
+            else:
+                pos[sel] = self.props[k].ecef(flat[sel])
+
+        shape = t.shape + (3,)
+        if not velocity:
+            return pos.reshape(shape)
+        return pos.reshape(shape), vel.reshape(shape)
+
+
+def find_roots(f, a, b, fa, fb, tol=TOL, maxiter=MAXITER):
+    """Refine the roots of many brackets at once.
+
+    Uses the Illinois variant of regula falsi.  f(t, idx) returns the function
+    at times `t` for the brackets selected by the integer array `idx`, so
+    converged brackets are not evaluated again.  fa and fb are the function
+    values at the ends of the brackets and must differ in sign.
+    """
+    a = np.array(a, dtype=float)
+    b = np.array(b, dtype=float)
+    fa = np.array(fa, dtype=float)
+    fb = np.array(fb, dtype=float)
+    active = np.arange(a.size)
+    for _ in range(maxiter):
+        if active.size == 0:
+            break
+        ai, bi, fai, fbi = a[active], b[active], fa[active], fb[active]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ci = bi - fbi * (bi - ai) / (fbi - fai)
+        ci = np.where(np.isfinite(ci), ci, 0.5 * (ai + bi))
+        fci = f(ci, active)
+
+        # keep the end with the opposite sign, halve it if kept twice
+        same = np.signbit(fci) == np.signbit(fbi)
+        a[active] = np.where(same, ai, bi)
+        fa[active] = np.where(same, 0.5 * fai, fbi)
+        b[active] = ci
+        fb[active] = fci
+
+        done = (np.abs(ci - bi) <= tol) | (fci == 0.0) | ~np.isfinite(fci)
+        active = active[~done]
+    return b
+
+
+def find_tca(prop, station_pos, station_rot, which, a, b, tol=TOL):
+    """Refine the elevation maxima of stations `which` bracketed by [a, b].
+
+    Returns the times of closest approach, NaN where the elevation is not
+    rising at `a` and falling at `b`.
+    """
+    def rate_at(t, which):
+        pos, vel = prop.ecef(t, velocity=True)
+        return elevation_rate(pos, vel, station_pos[which], station_rot[which])
+
+    n = len(which)
+    r = rate_at(np.concatenate((a, b)), np.concatenate((which, which)))
+    ra, rb = r[:n], r[n:]
+    t = np.full(n, np.nan)
+    ok = np.nonzero((ra > 0.0) & (rb < 0.0))[0]
+    if len(ok):
+        t[ok] = find_roots(lambda t, idx: rate_at(t, which[ok[idx]]),
+                           a[ok], b[ok], ra[ok], rb[ok], tol)
+    return t
+
+
+def find_passes(prop, station_pos, station_rot, horizon,
+                duration=None, num_passes=None,
+                steps_per_orbit=STEPS_PER_ORBIT, tol=TOL):
+    """Find all passes of one satellite over one or more ground stations.
+
+    Arguments:
+    prop -- Propagator for the satellite
+    station_pos, station_rot -- as returned by station_frames()
+    horizon -- minimum elevation in degrees, scalar or one per station
+    duration -- seconds, passes must rise within [0, duration]
+    num_passes -- keep at most this many passes per station
+
+    Passes in progress at the start of the window are skipped, a pass which
+    rises within the window is followed past its end until it sets.
+
+    Returns a dict of equal length arrays, ordered by station then rise:
+    'station' index, 'rise', 'set', 'tca' times in seconds, 'rise_az',
+    'set_az', 'max_el' in degrees.
+    """
+    nstations = len(station_pos)
+    horizon = np.broadcast_to(np.asarray(horizon, dtype=float), (nstations,))
+
+    period = prop.period
+    step = period / steps_per_orbit
+    limit = MAX_SEARCH if duration is None else duration
+    # no pass of a (non-geostationary) satellite lasts longer than an orbit
+    t_end = limit + period
+    max_chunk = min(max(64, CHUNK_SIZE // nstations), ceil(t_end / step) + 2)
+    if num_passes is not None and duration is None:
+        # start with a window of a few orbits per pass wanted and double it
+        # until every station has seen them rise
+        chunk = min(max_chunk, (num_passes + 2) * steps_per_orbit)
+    else:
+        chunk = max_chunk
+    # one sample before the start, so a peak right at the start is bracketed
+    t_first = -step
+
+    # horizon crossings as (station, sample index before the crossing, rising)
+    stations, samples, kinds = [], [], []
+    # sampled maxima which stayed just below the horizon
+    peak_stations, peak_samples = [], []
+    nrises = np.zeros(nstations, dtype=int)
+    prev = None
+    i0 = 0
+    while t_first + i0 * step <= t_end:
+        t = t_first + (i0 + np.arange(chunk)) * step
+        el = elevation(prop.ecef(t)[np.newaxis], station_pos[:, np.newaxis],
+                       station_rot[:, np.newaxis])
+        el -= horizon[:, np.newaxis]
+
+        # keep the last two samples of the previous chunk as neighbors
+        if prev is None:
+            ext = el
+            base, skip = i0, 0
+        else:
+            ext = np.concatenate((prev, el), axis=1)
+            base, skip = i0 - 2, 1
+        up = ext >= 0.0
+
+        gs, k = np.nonzero(up[:, skip + 1:] != up[:, skip:-1])
+        k += skip
+        rising = up[gs, k + 1]
+        stations.append(gs)
+        samples.append(base + k)
+        kinds.append(rising)
+        np.add.at(nrises, gs[rising], 1)
+
+        # A short, low pass can fit between two samples.  Look for local
+        # maxima below the horizon and estimate the peak from a parabola
+        # through the three samples.
+        y0, y1, y2 = ext[:, :-2], ext[:, 1:-1], ext[:, 2:]
+        curve = 2.0 * y1 - y0 - y2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vertex = y1 + (y0 - y2)**2 / (8.0 * curve)
+        gs, k = np.nonzero((y1 < 0.0) & (y1 > y0) & (y1 >= y2)
+                           & (y0 < 0.0) & (y2 < 0.0)
+                           & (vertex > -PEAK_MARGIN))
+        peak_stations.append(gs)
+        peak_samples.append(base + k + 1)
+
+        prev = ext[:, -2:]
+        i0 += chunk
+        chunk = min(2 * chunk, max_chunk)
+
+        down = not up[:, -1].any()
+        if t[-1] >= limit and down:
+            break
+        if (num_passes is not None and duration is None
+                and nrises.min() >= num_passes and down):
+            break
+
+    def el_at(t, which):
+        return (elevation(prop.ecef(t), station_pos[which], station_rot[which])
+                - horizon[which])
+
+    def find_maxima(a, b, which):
+        return find_tca(prop, station_pos, station_rot, which, a, b, tol)
+
+    gs = np.concatenate(stations)
+    k = np.concatenate(samples)
+    rising = np.concatenate(kinds)
+
+    # pair each rise with the following set at the same station
+    order = np.lexsort((k, gs))
+    gs, k, rising = gs[order], k[order], rising[order]
+    paired = (rising[:-1] & ~rising[1:]) & (gs[:-1] == gs[1:])
+    idx = np.nonzero(paired)[0]
+    gs = gs[idx]
+    lo_rise = t_first + k[idx] * step
+    lo_set = t_first + k[idx + 1] * step
+    hi_rise = lo_rise + step
+    hi_set = lo_set + step
+
+    # find which of the candidate peaks actually clear the horizon
+    peak_gs = np.concatenate(peak_stations)
+    if len(peak_gs):
+        t_peak = t_first + np.concatenate(peak_samples) * step
+        t_peak = find_maxima(t_peak - step, t_peak + step, peak_gs)
+        found = np.nonzero(np.isfinite(t_peak))[0]
+        visible = found[el_at(t_peak[found], peak_gs[found]) >= 0.0]
+        peak_gs, t_peak = peak_gs[visible], t_peak[visible]
+        gs = np.concatenate((gs, peak_gs))
+        lo_rise = np.concatenate((lo_rise, t_peak - step))
+        hi_rise = np.concatenate((hi_rise, t_peak))
+        lo_set = np.concatenate((lo_set, t_peak))
+        hi_set = np.concatenate((hi_set, t_peak + step))
+
+    if len(gs) == 0:
+        return _no_passes()
+
+    # refine the rise and set times together
+    n = len(gs)
+    which = np.concatenate((gs, gs, gs, gs))
+    lo = np.concatenate((lo_rise, lo_set))
+    hi = np.concatenate((hi_rise, hi_set))
+    g = el_at(np.concatenate((lo, hi)), which)
+    times = find_roots(lambda t, idx: el_at(t, which[idx]),
+                       lo, hi, g[:2 * n], g[2 * n:], tol)
+    t_rise, t_set = times[:n], times[n:]
+
+    order = np.lexsort((t_rise, gs))
+    gs, t_rise, t_set = gs[order], t_rise[order], t_set[order]
+    keep = (t_rise >= 0.0) & (t_rise <= limit)
+    gs, t_rise, t_set = gs[keep], t_rise[keep], t_set[keep]
+
+    if num_passes is not None and len(gs):
+        # rank of each pass within its station, already ordered by rise
+        first = np.searchsorted(gs, gs, side='left')
+        keep = (np.arange(len(gs)) - first) < num_passes
+        gs, t_rise, t_set = gs[keep], t_rise[keep], t_set[keep]
+    if len(gs) == 0:
+        return _no_passes()
+
+    # A pass of a high orbit can have more than one elevation maximum, the
+    # highest sample of each pass brackets the highest one.
+    nsamples = np.floor((t_set - t_rise) / step).astype(int) + 2
+    ends = np.cumsum(nsamples)
+    idx = np.repeat(np.arange(len(gs)), nsamples)
+    t = np.minimum(t_rise[idx] + (np.arange(ends[-1]) - (ends - nsamples)[idx])
+                   * step, t_set[idx])
+    el = elevation(prop.ecef(t), station_pos[gs[idx]], station_rot[gs[idx]])
+    t_best = t[np.lexsort((el, idx))[ends - 1]]
+    t_tca = find_maxima(np.maximum(t_best - step, t_rise),
+                        np.minimum(t_best + step, t_set), gs)
+    # a pass without a clear peak, e.g. clipped by an orbit decay
+    t_tca = np.where(np.isfinite(t_tca), t_tca, 0.5 * (t_rise + t_set))
+
+    n = len(gs)
+    which = np.concatenate((gs, gs, gs))
+    az, el = look_angles(prop.ecef(np.concatenate((t_rise, t_set, t_tca))),
+                         station_pos[which], station_rot[which])
+
+    return {
+        'station': gs,
+        'rise': t_rise,
+        'set': t_set,
+        'tca': t_tca,
+        'rise_az': az[:n],
+        'set_az': az[n:2 * n],
+        'max_el': el[2 * n:],
+    }
+
+
+def find_peaks(prop, station_pos, station_rot, t0, t1,
+               steps_per_orbit=PEAK_STEPS_PER_ORBIT, tol=TOL):
+    """Find every elevation maximum between t0 and t1 seconds.
+
+    The elevation is sampled a few times per orbit, just enough to bracket
+    each local maximum, which is then refined.  Eccentric orbits are sampled
+    by their Propagator.perigee_period, to bracket the maxima near perigee
+    as well.  Maxima below the horizon are included, they are the closest
+    approaches of orbits without a pass.
+
+    Returns (station index, time, elevation) arrays ordered by station then
+    time.
+    """
+    nstations = len(station_pos)
+    step = prop.perigee_period / steps_per_orbit
+    chunk = max(64, CHUNK_SIZE // nstations)
+    # one extra sample on each side to bracket maxima at the ends
+    nsamples = ceil((t1 - t0) / step) + 3
+
+    stations, samples = [], []
+    prev = None
+    for i0 in range(0, nsamples, chunk):
+        t = t0 + (i0 - 1 + np.arange(min(chunk, nsamples - i0))) * step
+        el = elevation(prop.ecef(t)[np.newaxis], station_pos[:, np.newaxis],
+                       station_rot[:, np.newaxis])
+
+        # keep the last two samples of the previous chunk as neighbors
+        if prev is None:
+            ext, base = el, i0
+        else:
+            ext, base = np.concatenate((prev, el), axis=1), i0 - 2
+        y0, y1, y2 = ext[:, :-2], ext[:, 1:-1], ext[:, 2:]
+        gs, k = np.nonzero((y1 > y0) & (y1 >= y2))
+        stations.append(gs)
+        samples.append(base + k + 1)
+        prev = ext[:, -2:]
+
+    gs = np.concatenate(stations)
+    t = t0 + (np.concatenate(samples) - 1) * step
+    t = find_tca(prop, station_pos, station_rot, gs, t - step, t + step, tol)
+
+    keep = np.isfinite(t) & (t >= t0) & (t <= t1)
+    gs, t = gs[keep], t[keep]
+    order = np.lexsort((t, gs))
+    gs, t = gs[order], t[order]
+    if len(gs) == 0:
+        return gs, t, t.copy()
+    el = elevation(prop.ecef(t), station_pos[gs], station_rot[gs])
+    return gs, t, el
+
+
+def find_passes_peaks(prop, station_pos, station_rot, horizon,
+                      duration=None, num_passes=None,
+                      steps_per_orbit=PEAK_STEPS_PER_ORBIT, tol=TOL):
+    """Find passes by first finding the elevation maxima, see find_peaks().
+
+    Only the maxima above the horizon are searched for their rise and set,
+    stepping away from them by the sampling interval until the elevation is
+    below the horizon.  Maxima within the same pass, as of high orbits, are
+    one pass.  A satellite which stays up for more than an orbit on either
+    side of a maximum is searched with find_passes() instead.
+
+    Arguments and return value are the same as for find_passes().
+    """
+    nstations = len(station_pos)
+    horizon = np.broadcast_to(np.asarray(horizon, dtype=float), (nstations,))
+
+    period = prop.period
+    # the sampling interval of find_peaks()
+    step = prop.perigee_period / steps_per_orbit
+    limit = MAX_SEARCH if duration is None else duration
+    # no pass of a (non-geostationary) satellite lasts longer than an orbit
+    t_stop = limit + period
+    if num_passes is not None and duration is None:
+        # start with a window of a few orbits per pass wanted and double it
+        # until every station has that many passes
+        span = (num_passes + 2) * period
+    else:
+        span = t_stop
+
+    found = []
+    t0 = 0.0
+    while t0 < t_stop:
+        t1 = min(t0 + span, t_stop)
+        gs, t_tca, max_el = find_peaks(prop, station_pos, station_rot,
+                                       t0, t1, steps_per_orbit, tol)
+        # a maximum right at t0 was found by the previous window
+        visible = (max_el >= horizon[gs]) & ((t_tca > t0) | (t0 == 0.0))
+        gs, t_tca, max_el = gs[visible], t_tca[visible], max_el[visible]
+
+        if len(gs):
+            t_rise, t_set = _rise_set(prop, station_pos, station_rot,
+                                      horizon[gs], gs, t_tca, max_el, step,
+                                      tol)
+            if not np.isfinite(t_rise).all():
+                return find_passes(prop, station_pos, station_rot, horizon,
+                                   duration=duration, num_passes=num_passes,
+                                   tol=tol)
+            keep = (t_rise >= 0.0) & (t_rise <= limit)
+            found.append((gs[keep], t_rise[keep], t_set[keep], t_tca[keep],
+                          max_el[keep]))
+
+        if num_passes is not None and found:
+            passes = _one_per_pass(*(np.concatenate(a) for a in zip(*found)))
+            found = [passes]
+            counts = np.bincount(passes[0], minlength=nstations)
+            if counts.min() >= num_passes:
+                break
+        t0 = t1
+        span *= 2
+
+    if not found:
+        return _no_passes()
+    gs, t_rise, t_set, t_tca, max_el = _one_per_pass(
+        *(np.concatenate(a) for a in zip(*found)))
+
+    if num_passes is not None and len(gs):
+        first = np.searchsorted(gs, gs, side='left')
+        keep = (np.arange(len(gs)) - first) < num_passes
+        gs, t_rise, t_set = gs[keep], t_rise[keep], t_set[keep]
+        t_tca, max_el = t_tca[keep], max_el[keep]
+    if len(gs) == 0:
+        return _no_passes()
+
+    n = len(gs)
+    which = np.concatenate((gs, gs))
+    az, _ = look_angles(prop.ecef(np.concatenate((t_rise, t_set))),
+                        station_pos[which], station_rot[which])
+
+    return {
+        'station': gs,
+        'rise': t_rise,
+        'set': t_set,
+        'tca': t_tca,
+        'rise_az': az[:n],
+        'set_az': az[n:],
+        'max_el': max_el,
+    }
+
+
+def _one_per_pass(gs, t_rise, t_set, t_tca, max_el):
+    """Returns the passes of elevation maxima ordered by station then rise,
+    with the highest maximum of each pass.  Maxima at a station whose rise
+    is before the set of the previous one are in the same pass.
+    """
+    order = np.lexsort((t_rise, gs))
+    gs, t_rise, t_set = gs[order], t_rise[order], t_set[order]
+    t_tca, max_el = t_tca[order], max_el[order]
+
+    same = (gs[1:] == gs[:-1]) & (t_rise[1:] <= t_set[:-1])
+    if not same.any():
+        return gs, t_rise, t_set, t_tca, max_el
+    group = np.concatenate(([0], np.cumsum(~same)))
+    # the highest maximum first in each pass
+    order = np.lexsort((-max_el, group))
+    first = order[np.concatenate(([True], group[order][1:]
+                                  != group[order][:-1]))]
+    return gs[first], t_rise[first], t_set[first], t_tca[first], max_el[first]
+
+
+def _rise_set(prop, station_pos, station_rot, horizon, which, t_tca, max_el,
+              step, tol=TOL):
+    """Refine the rise and set around maxima above the horizon.
+
+    The elevation is sampled every `step` seconds before and after each
+    TCA, for up to an orbit, and the rise and set are refined between the
+    first sample below the horizon and the sample before it.  `horizon` is
+    given for each maximum.  Returns the rise and set times, both NaN where
+    the satellite does not go below the horizon within an orbit on either
+    side.
+    """
+    n = len(which)
+
+    def el_at(t, idx):
+        return (elevation(prop.ecef(t), station_pos[both[idx]],
+                          station_rot[both[idx]])
+                - limit[idx])
+
+    # the rises before and the sets after the maxima
+    both = np.concatenate((which, which))
+    limit = np.concatenate((horizon, horizon))
+    t_near = np.concatenate((t_tca, t_tca))
+    g_near = np.concatenate((max_el - horizon, max_el - horizon))
+    sign = np.repeat((-1.0, 1.0), n)
+    t_far = np.full(2 * n, np.nan)
+    g_far = np.full(2 * n, np.nan)
+
+    active = np.arange(2 * n)
+    for _ in range(ceil(prop.period / step)):
+        if active.size == 0:
+            break
+        t = t_near[active] + sign[active] * step
+        g = el_at(t, active)
+        down = g < 0.0
+        t_far[active[down]] = t[down]
+        g_far[active[down]] = g[down]
+        up = active[~down]
+        t_near[up] = t[~down]
+        g_near[up] = g[~down]
+        active = up
+
+    ok = np.isfinite(t_far)
+    ok = ok[:n] & ok[n:]
+    times = np.full(2 * n, np.nan)
+    sel = np.nonzero(np.concatenate((ok, ok)))[0]
+    if len(sel):
+        times[sel] = find_roots(lambda t, idx: el_at(t, sel[idx]),
+                                t_near[sel], t_far[sel], g_near[sel],
+                                g_far[sel], tol)
+    return times[:n], times[n:]
+
+
+def match_tca(prop0, prop1, station_pos, station_rot, horizon, which,
+              aos, los, steps_per_orbit=2 * PEAK_STEPS_PER_ORBIT, tol=TOL):
+    """Find the passes of a new TLE matching passes of an old one.
+
+    prop0 and prop1 propagate the old and new TLE from the same start.  Each
+    old pass is given by its station index in `which` and its rise and set
+    times `aos` and `los`.  Its TCA is refined with prop0, then the elevation
+    maximum of prop1 closest to it, within half an orbit either way, is the
+    new TCA.  Only the orbits around each pass are propagated.  See
+    notes/jobs-across-tle-changes.adoc.
+
+    Returns a dict of arrays, one entry per pass: the old 'tca0', and the
+    new 'tca', 'max_el', 'rise' and 'set'.  Rise and set are NaN where the
+    new maximum is below the station's horizon, or the satellite stays up
+    for more than an orbit on either side of it.
+    """
+    which = np.asarray(which, dtype=int)
+    aos = np.asarray(aos, dtype=float)
+    los = np.asarray(los, dtype=float)
+    horizon = np.broadcast_to(np.asarray(horizon, dtype=float),
+                              (len(station_pos),))[which]
+    n = len(which)
+    if n == 0:
+        empty = np.zeros(0)
+        return {'tca0': empty, 'tca': empty, 'max_el': empty,
+                'rise': empty, 'set': empty}
+
+    # passes cut short by the end of a window keep their middle
+    tca0 = find_tca(prop0, station_pos, station_rot, which, aos, los, tol)
+    tca0 = np.where(np.isfinite(tca0), tca0, (aos + los) / 2.0)
+
+    # sampled as find_peaks() does, over half an orbit on either side
+    period = prop1.period
+    step = prop1.perigee_period / steps_per_orbit
+    half = ceil(period / 2.0 / step)
+    t = tca0[:, np.newaxis] + np.arange(-half, half + 1) * step
+    el = elevation(prop1.ecef(t), station_pos[which][:, np.newaxis],
+                   station_rot[which][:, np.newaxis])
+
+    # the sampled maximum closest to the old TCA
+    y0, y1, y2 = el[:, :-2], el[:, 1:-1], el[:, 2:]
+    peak = (y1 > y0) & (y1 >= y2)
+    distance = np.where(peak, np.abs(np.arange(1, 2 * half) - half),
+                        2 * half)
+    k = np.argmin(distance, axis=1) + 1
+    k = np.where(peak.any(axis=1), k, np.argmax(el, axis=1))
+    t_peak = t[np.arange(n), k]
+
+    tca = find_tca(prop1, station_pos, station_rot, which,
+                   t_peak - step, t_peak + step, tol)
+    tca = np.where(np.isfinite(tca), tca, t_peak)
+    max_el = elevation(prop1.ecef(tca), station_pos[which], station_rot[which])
+
+    rise = np.full(n, np.nan)
+    fall = np.full(n, np.nan)
+    up = np.nonzero(max_el >= horizon)[0]
+    if len(up):
+        rise[up], fall[up] = _rise_set(prop1, station_pos, station_rot,
+                                       horizon[up], which[up], tca[up],
+                                       max_el[up], step, tol)
+    return {'tca0': tca0, 'tca': tca, 'max_el': max_el,
+            'rise': rise, 'set': fall}
+
+
+def _no_passes():
+    empty = np.zeros(0)
+    return {
+        'station': np.zeros(0, dtype=int),
+        'rise': empty,
+        'set': empty,
+        'tca': empty,
+        'rise_az': empty,
+        'set_az': empty,
+        'max_el': empty,
+    }
@@ -44,9 +44,21 @@ class RandomScheduler(Scheduler):
 
 
 class FirstScheduler(Scheduler):
-    """Make requests in order of start time."""
+    """Make requests in order of start time.
+
+    With ordered=True the passes are taken to be in start time order
+    already, as from db.iterpasses(), and are consumed as they go instead
+    of sorted.
+    """
+    def __init__(self, clients, satellites, passes=None, debug=False,
+                 ordered=False):
+        self.ordered = ordered
+        super().__init__(clients, satellites, passes=passes, debug=debug)
+
     def __call__(self, passes):
-        for pd in sorted(passes, key=lambda p: p.begin):
+        if not self.ordered:
+            passes = sorted(passes, key=lambda p: p.begin)
+        for pd in passes:
             self.do_request(pd)
 
 
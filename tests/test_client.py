@@ -0,0 +1,84 @@
+"""Tests of satbazaar.client with the TLEs of the benchmark."""
+
+from datetime import datetime, timedelta, timezone
+import os
+
+import numpy as np
+from iso8601 import parse_date
+import pytest
+
+from satbazaar import client, predict
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK = os.path.join(HERE, '..', 'python-files', 'benchmark')
+TLE_FILE = os.path.join(BENCHMARK, 'amateur.txt')
+HIGH_TLE_FILE = os.path.join(BENCHMARK, 'high-orbits.txt')
+
+# the fixture TLEs are from early June 2017
+START = datetime(2017, 6, 8, tzinfo=timezone.utc)
+
+# Valparaiso, IN
+STATION = {'name': 'valpo', 'lat': 41.46, 'lon': -87.04, 'alt': 245.0}
+
+
+def load_tles(filename, n=None):
+    with open(filename) as f:
+        lines = [line.rstrip() for line in f if line.strip()]
+    return [lines[i:i + 3] for i in range(0, len(lines), 3)][:n]
+
+
+def checksum(line):
+    return str(sum(int(c) if c.isdigit() else c == '-'
+                   for c in line[:68]) % 10)
+
+
+def newer(tle, days, anomaly):
+    """Returns tle with its epoch `days` later and its mean anomaly moved
+    along by the orbit and `anomaly` degrees more.
+    """
+    epoch = float(tle[1][20:32]) + days
+    n = float(tle[2][52:63])
+    m = (float(tle[2][43:51]) + 360.0 * n * days + anomaly) % 360.0
+    line1 = tle[1][:20] + '%012.8f' % epoch + tle[1][32:68]
+    line2 = tle[2][:43] + '%8.4f' % m + tle[2][51:68]
+    return [tle[0], line1 + checksum(line1), line2 + checksum(line2)]
+
+
+def passes(tle):
+    pos, rot = predict.station_frames([STATION['lat']], [STATION['lon']],
+                                      [STATION['alt']])
+    return predict.find_passes(predict.Propagator(tle, START), pos, rot,
+                               0.0, duration=3 * predict.SECONDS_PER_DAY)
+
+
+@pytest.fixture(params=load_tles(TLE_FILE, 1) + load_tles(HIGH_TLE_FILE),
+                ids=lambda tle: tle[0].strip())
+def tle(request):
+    return request.param
+
+
+def test_rematch(tle):
+    """Every job is moved onto its pass of the new TLE, long ones included,
+    to the microsecond.
+    """
+    new = newer(tle, 0.5, 0.5)
+    old_passes, new_passes = passes(tle), passes(new)
+    assert len(old_passes['rise']) == len(new_passes['rise']) > 0
+
+    c = client.AllClient(dict(STATION))
+    for i, (rise, fall) in enumerate(zip(old_passes['rise'],
+                                         old_passes['set'])):
+        job = {'id': i,
+               'start': (START + timedelta(seconds=rise)).isoformat(),
+               'end': (START + timedelta(seconds=fall)).isoformat(),
+               'tle0': tle[0], 'tle1': tle[1], 'tle2': tle[2]}
+        c.request({'job': job, 'bounty': []})
+
+    updated, cancelled = c.rematch(new)
+    assert cancelled == []
+    assert len(updated) == len(new_passes['rise'])
+    jobs = sorted((r['job'] for r in updated), key=lambda job: job['start'])
+    for key, field in (('rise', 'start'), ('set', 'end')):
+        t = [(parse_date(job[field]) - START).total_seconds() for job in jobs]
+        np.testing.assert_allclose(t, new_passes[key], atol=0.1)
@@ -0,0 +1,250 @@
+"""Tests of satbazaar.db which need no network access."""
+
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import sqlite3
+import threading
+import warnings
+
+import pytest
+import requests_cache
+
+from satbazaar import db
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TLE_FILE = os.path.join(HERE, '..', 'python-files', 'benchmark',
+                        'amateur.txt')
+
+
+def load_tles(n):
+    with open(TLE_FILE) as f:
+        lines = [line.rstrip() for line in f if line.strip()]
+    return [lines[i:i + 3] for i in range(0, 3 * n, 3)]
+
+
+class TLEServer(BaseHTTPRequestHandler):
+    """Serves `body` with `etag`, answering a matching If-None-Match with
+    304.  The status of every response is appended to `statuses` before
+    it is sent.
+    """
+    body = b''
+    etag = None
+    statuses = []
+
+    def do_GET(self):
+        # record the status before the client can see the response
+        if self.headers.get('If-None-Match') == self.etag:
+            self.statuses.append(304)
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+            return
+        self.statuses.append(200)
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PageServer(BaseHTTPRequestHandler):
+    """Serves `pages`, a dict of path -> (status, body).  The path of every
+    request is appended to `paths`.
+    """
+    pages = {}
+    paths = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        status, body = self.pages.get(self.path, (404, b'Not Found'))
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_server(handler):
+    """Returns a started server of handler on a free local port."""
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
+
+
+@pytest.fixture
+def server():
+    handler = type('Handler', (TLEServer,), {'statuses': []})
+    httpd = run_server(handler)
+    try:
+        yield handler, 'http://127.0.0.1:%i/tle.txt' % httpd.server_port
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture
+def api_server():
+    handler = type('Handler', (PageServer,), {'pages': {}, 'paths': []})
+    httpd = run_server(handler)
+    try:
+        with requests_cache.disabled():
+            yield handler, 'http://127.0.0.1:%i' % httpd.server_port
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def tle_text(tles):
+    return ''.join(line + '\n' for tle in tles for line in tle).encode()
+
+
+def tle_page(tle):
+    """Returns a per-satellite page as the CelesTrak tle_url serves it."""
+    return ('<html><body><pre>\n' + '\n'.join(tle)
+            + '\n\n</pre></body></html>').encode()
+
+
+def serve(handler, tles, etag):
+    handler.body = tle_text(tles)
+    handler.etag = etag
+
+
+def test_file_source_reload(server):
+    """reload() is a no-op on 304 and returns exactly the changed TLEs."""
+    handler, url = server
+    tles = load_tles(4)
+    serve(handler, tles[:3], '"v1"')
+
+    source = db.FileTLESource('test', url)
+    assert sorted(source) == sorted(db.TLE(t).norad for t in tles[:3])
+
+    assert source.reload() == set()
+    assert handler.statuses == [200, 304]
+
+    # one TLE changed, one added, one the same
+    changed = list(tles[1])
+    changed[2] = changed[2][:60] + ('1' if changed[2][60] != '1'
+                                    else '2') + changed[2][61:]
+    serve(handler, [tles[0], changed, tles[2], tles[3]], '"v2"')
+    assert source.reload() == {db.TLE(tles[1]).norad,
+                               db.TLE(tles[3]).norad}
+    assert handler.statuses == [200, 304, 200]
+    assert source[db.TLE(tles[1]).norad].line2 == changed[2]
+
+    assert source.reload() == set()
+    assert handler.statuses == [200, 304, 200, 304]
+
+
+def test_getpasses_copies(tmp_path):
+    """Modifying a tree from getpasses() does not change later results."""
+    passes_db = str(tmp_path / 'passes.db')
+    conn = sqlite3.connect(passes_db)
+    db._create_passes_tables(conn.cursor())
+    conn.executemany('INSERT INTO passes VALUES (?,?,?,?,?,?,?,?,?)', [
+        ('2017-06-08 00:%02i:00' % m, '2017-06-08 00:%02i:00' % (m + 5),
+         300.0, 10.0, 200.0, '2017-06-08 00:%02i:30' % (m + 2), 45.0,
+         'gs', 25544) for m in (0, 10, 20)])
+    conn.commit()
+    conn.close()
+
+    db.clear_passes_cache()
+    tree = db.getpasses(passes_db)
+    assert len(tree) == 3
+    tree.remove(sorted(tree)[0])
+    assert len(db.getpasses(passes_db)) == 3
+    assert db.getpasses(passes_db) is not db.getpasses(passes_db)
+    db.clear_passes_cache()
+
+
+def test_api_get_many(api_server):
+    """get_many() fetches the group file once and only looks up the
+    satellites which are not in it one by one.
+    """
+    handler, url = api_server
+    tles = load_tles(4)
+    norads = [db.TLE(tle).norad for tle in tles]
+    handler.pages['/group.txt'] = (200, tle_text(tles[:2]))
+    handler.pages['/sat/%i' % norads[2]] = (200, tle_page(tles[2]))
+    # the last satellite is in neither the group file nor the API
+    handler.pages['/sat/%i' % norads[3]] = (200, b'No TLE found')
+
+    source = db.TLESource([('api', db.APITLESource, url + '/sat/{}',
+                            [url + '/group.txt'])])
+    found = source.get_many(norads)
+    assert sorted(found) == sorted(norads[:3])
+    for tle, norad in zip(tles, norads[:3]):
+        assert found[norad].line2 == tle[2]
+    assert sorted(handler.paths) == sorted(
+        ['/group.txt'] + ['/sat/%i' % norad for norad in norads[2:]])
+
+
+def test_api_failed_not_missed(api_server, tmp_path):
+    """Rate limited or failed lookups are not recorded as misses."""
+    handler, url = api_server
+    norads = [25544, 7530]
+    for norad in norads:
+        handler.pages['/sat/%i' % norad] = (429, b'Too Many Requests')
+
+    misses = db.TLEMissCache(str(tmp_path / 'misses.db'))
+    source = db.TLESource([('api', db.APITLESource, url + '/sat/{}')],
+                          misses=misses)
+    assert source.get_many(norads) == {}
+    assert source.data_source['api'].failed == set(norads)
+    assert misses.missing('api') == set()
+    misses.close()
+
+
+def test_migrate_tle_epochs(tmp_path):
+    """An old tle table is migrated, committed, and writable by another
+    connection right away.
+    """
+    tle_db = str(tmp_path / 'tle.sqlite')
+    tles = [db.TLE(tle) for tle in load_tles(2)]
+    conn = sqlite3.connect(tle_db)
+    db.create_tle_table(conn.cursor())
+    late = [(tle.norad, tle.epoch + timedelta(days=1), tle.line0, tle.line1,
+             tle.line2, datetime(2017, 6, 8)) for tle in tles]
+    # the second TLE was also downloaded again with the right epoch
+    conn.executemany('INSERT INTO tle VALUES (?,?,?,?,?,?)',
+                     late + [(tles[1].norad, tles[1].epoch) + late[1][2:]])
+    conn.execute('PRAGMA user_version = 0;')
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(tle_db, detect_types=sqlite3.PARSE_DECLTYPES)
+    db.create_tle_table(conn.cursor())
+    misses = db.TLEMissCache(tle_db)
+    misses.add('test', [1])
+    misses.close()
+
+    rows = conn.execute('SELECT norad, epoch FROM tle ORDER BY norad')
+    assert rows.fetchall() == sorted(
+        (tle.norad, tle.epoch.replace(tzinfo=None)) for tle in tles)
+    assert conn.execute('PRAGMA user_version;').fetchone() == (
+        db.TLE_DB_VERSION,)
+    conn.close()
+
+
+def test_pass_store_aware_times():
+    """PassStore.query() takes aware times as UTC, without warnings."""
+    start = datetime(2017, 6, 8)
+    passes = [db.PassTuple(start + timedelta(minutes=m),
+                           start + timedelta(minutes=m + 5), 300.0, 10.0,
+                           200.0, start + timedelta(minutes=m + 2), 45.0,
+                           'gs', 25544) for m in (0, 10, 20)]
+    store = db.PassStore.from_passes(passes)
+    cest = timezone(timedelta(hours=2))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        found = store.query(start=datetime(2017, 6, 8, 2, 12, tzinfo=cest),
+                            end=datetime(2017, 6, 8, 0, 21,
+                                         tzinfo=timezone.utc))
+    assert list(found) == passes[1:]
@@ -0,0 +1,84 @@
+"""Tests of satbazaar.predict with the TLEs and stations of the benchmark."""
+
+from datetime import datetime
+import json
+import os
+
+import numpy as np
+import pytest
+
+from satbazaar import predict
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK = os.path.join(HERE, '..', 'python-files', 'benchmark')
+TLE_FILE = os.path.join(BENCHMARK, 'amateur.txt')
+# a GPS-like MEO and a Molniya-like HEO, with passes of many hours
+HIGH_TLE_FILE = os.path.join(BENCHMARK, 'high-orbits.txt')
+STATIONS_FILE = os.path.join(BENCHMARK, 'stations.json')
+
+# the fixture TLEs are from early June 2017
+START = datetime(2017, 6, 8)
+
+# Valparaiso, IN
+STATION = ([41.46], [-87.04], [245.0])
+
+
+def load_tles(filename, n=None):
+    with open(filename) as f:
+        lines = [line.rstrip() for line in f if line.strip()]
+    return [lines[i:i + 3] for i in range(0, len(lines), 3)][:n]
+
+
+@pytest.fixture(params=load_tles(TLE_FILE, 3) + load_tles(HIGH_TLE_FILE),
+                ids=lambda tle: tle[0].strip())
+def tle(request):
+    return request.param
+
+
+def test_num_passes_calls(tle):
+    """A num_passes-only search propagates a few orbits, not MAX_SEARCH."""
+    pos, rot = predict.station_frames(*map(np.array, STATION))
+    prop = predict.Propagator(tle, START)
+    found = predict.find_passes(prop, pos, rot, 0.0, num_passes=5)
+    assert len(found['rise']) == 5
+    assert prop.calls < 5000
+
+    ref = predict.find_passes(predict.Propagator(tle, START), pos, rot, 0.0,
+                              duration=5 * predict.SECONDS_PER_DAY)
+    np.testing.assert_allclose(found['rise'], ref['rise'][:5])
+
+
+def test_num_passes_calls_peaks(tle):
+    """find_passes_peaks() stops once every station has num_passes."""
+    pos, rot = predict.station_frames(*map(np.array, STATION))
+    prop = predict.Propagator(tle, START)
+    found = predict.find_passes_peaks(prop, pos, rot, 0.0, num_passes=5)
+    assert len(found['rise']) == 5
+    assert prop.calls < 5000
+
+    ref = predict.find_passes_peaks(predict.Propagator(tle, START), pos, rot,
+                                    0.0, duration=5 * predict.SECONDS_PER_DAY)
+    np.testing.assert_allclose(found['rise'], ref['rise'][:5])
+
+
+def test_peaks_same_passes(tle):
+    """find_passes_peaks() finds the passes of find_passes() over the
+    benchmark stations, long ones included.
+    """
+    with open(STATIONS_FILE) as f:
+        stations = list(json.load(f).values())
+    pos, rot = predict.station_frames(
+        *(np.array([gs[key] for gs in stations])
+          for key in ('lat', 'lon', 'altitude')))
+    horizon = [gs['min_horizon'] for gs in stations]
+    duration = 3 * predict.SECONDS_PER_DAY
+    ref = predict.find_passes(predict.Propagator(tle, START), pos, rot,
+                              horizon, duration=duration)
+    found = predict.find_passes_peaks(predict.Propagator(tle, START), pos,
+                                      rot, horizon, duration=duration)
+    assert len(ref['rise']) > 0
+    np.testing.assert_array_equal(found['station'], ref['station'])
+    for key in ('rise', 'set', 'tca'):
+        np.testing.assert_allclose(found[key], ref[key], atol=1.0)
+    np.testing.assert_allclose(found['max_el'], ref['max_el'], atol=0.01)